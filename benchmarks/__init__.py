@@ -0,0 +1,3 @@
+"""Performance benchmarks for wp2md (not included to the package).
+
+Run from the repository root, e.g.: python -m benchmarks.html2text_reuse"""
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+"""Export throughput benchmark on a synthetic WXR dump.
+
+Measures end-to-end export, XML parsing alone, html2md() conversion alone
+and writing of rendered documents. Each stage is repeated and the best
+time is reported along with items/s and MB/s throughput. Results could
+be saved to a JSON file to compare them across commits.
+
+Usage example: python -m benchmarks.export --posts 2000 -o results.json"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from xml.etree.ElementTree import XMLParser
+from wp2md import wp2md
+from wp2md.version import get_version
+from . import wxrgen
+
+MB = 1024.0 * 1024
+
+
+class ErrorCounter(logging.Handler):
+    """Counts logged errors instead of printing them."""
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class Collector(object):
+    """Exporter replacement receiving parsed items. Keeps converted
+    fields if @keep is True, otherwise discards everything."""
+
+    def __init__(self, keep=False):
+        self.keep = keep
+        self.items = []
+        self.channel = None
+
+    def dump_item(self, data):
+        if self.keep:
+            self.items.append(data)
+
+    def dump_channel(self, meta, items):
+        self.channel = meta
+
+    def store_base_url(self, channel):
+        pass
+
+
+def get_commit():
+    """Returns current git commit hash or None."""
+    try:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=root, stderr=subprocess.STDOUT)
+        return output.decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def get_digest(dir_path):
+    """Returns a hash of all files content and relative paths in the
+    directory, to make sure the output did not change. Index export_date
+    is the current time, so it is excluded."""
+    digest = hashlib.sha1()
+    names = []
+    for root, dirs, files in os.walk(dir_path):
+        names.extend(os.path.join(root, name) for name in files)
+    for name in sorted(names):
+        relpath = os.path.relpath(name, dir_path).replace(os.sep, '/')
+        digest.update(relpath.encode('utf-8') + b'\0')
+        with open(name, 'rb') as f:
+            for line in f:
+                if not line.startswith(b'export_date:'):
+                    digest.update(line)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def best_time(func, repeat):
+    """Returns the best of @repeat func() run times in seconds."""
+    result = None
+    for i in range(repeat):
+        started = time.time()
+        func()
+        elapsed = time.time() - started
+        result = elapsed if result is None else min(result, elapsed)
+    return result
+
+
+def parse(file_name, target, chunk_size):
+    parser = XMLParser(target=wp2md.CustomParser(target))
+    for chunk in wp2md.read_chunks(file_name, chunk_size):
+        parser.feed(chunk)
+    parser.close()
+
+
+def bench_export(file_name, work_dir, options, repeat):
+    """End-to-end export, as performed by main()."""
+    out_dir = os.path.join(work_dir, 'export')
+    state = {}
+
+    def run():
+        shutil.rmtree(out_dir, ignore_errors=True)
+        exporter = wp2md.Exporter(wp2md.make_conf(file_name, dump_path=out_dir,
+                                                  **options))
+        exporter.run()
+        state['stats'] = exporter.stats
+
+    seconds = best_time(run, repeat)
+    items = state['stats']['post'] + state['stats']['page']
+    return seconds, items, os.path.getsize(file_name), get_digest(out_dir)
+
+
+def bench_parse(file_name, options, repeat):
+    """XML parsing with CustomParser, without any items processing."""
+    chunk_size = wp2md.make_conf(file_name, **options)['chunk_size']
+    collector = Collector()
+
+    def run():
+        parse(file_name, collector, chunk_size)
+
+    seconds = best_time(run, repeat)
+    collector = Collector(keep=True)
+    parse(file_name, collector, chunk_size)
+    return seconds, len(collector.items), os.path.getsize(file_name)
+
+
+def get_documents(file_name, options):
+    """Returns the list of HTML documents (contents and comments)
+    from the dump."""
+    collector = Collector(keep=True)
+    parse(file_name, collector, wp2md.DEFAULT_CHUNK_SIZE)
+    documents = []
+    for item in collector.items:
+        if item.get('post_type', None) not in ['post', 'page']:
+            continue
+        documents.append(item.get('content', ''))
+        for comment in item['comments']:
+            documents.append(comment.get('comment_content', ''))
+    return documents
+
+
+def bench_html2md(file_name, options, repeat):
+    """HTML to Markdown conversion of contents and comments."""
+    options = dict(options, cache_file=None)
+    exporter = wp2md.Exporter(wp2md.make_conf(file_name, **options))
+    documents = []
+    for html in get_documents(file_name, options):
+        # Warm-up pass, failing documents are excluded
+        try:
+            exporter.html2md(html)
+            documents.append(html)
+        except Exception:
+            pass
+    failed = len(get_documents(file_name, options)) - len(documents)
+    if failed:
+        print('html2md: %d documents failed to convert' % failed)
+
+    def run():
+        for html in documents:
+            exporter.html2md(html)
+
+    seconds = best_time(run, repeat)
+    size = sum(len(html.encode('utf-8')) for html in documents)
+    return seconds, len(documents), size
+
+
+def bench_dump(file_name, work_dir, options, repeat):
+    """Writing of rendered documents to files."""
+    out_dir = os.path.join(work_dir, 'dump')
+    options = dict(options, jobs=1, dump_path=out_dir)
+    exporter = wp2md.Exporter(wp2md.make_conf(file_name, **options))
+    collector = Collector(keep=True)
+    parse(file_name, collector, wp2md.DEFAULT_CHUNK_SIZE)
+    exporter.store_base_url(collector.channel)
+
+    # Render documents and allocate paths once, writes are measured only
+    documents = []
+    fields = [wp2md.FIELD_MAP.get(field, field)
+              for field in wp2md.WHAT2SAVE['item']]
+    for data in collector.items:
+        item_type = data.get('post_type', None)
+        if item_type not in ['post', 'page']:
+            continue
+        pdata = dict((wp2md.FIELD_MAP.get(field, field), data.get(field, ''))
+                     for field in wp2md.WHAT2SAVE['item'])
+        for field in ['created', 'created_gmt']:
+            pdata[field] = wp2md.parse_date(pdata[field],
+                                            exporter.conf['date_fmt'])
+        path = exporter.get_path(item_type, data=pdata)
+        text = exporter.render_safe(path, pdata, fields)
+        if text is not None:
+            documents.append((path, text))
+
+    def run():
+        shutil.rmtree(out_dir, ignore_errors=True)
+        for path, text in documents:
+            exporter.write(path, text)
+        exporter.close_writer()
+
+    seconds = best_time(run, repeat)
+    size = sum(len(text.encode('utf-8')) for path, text in documents)
+    return seconds, len(documents), size, get_digest(out_dir)
+
+
+def get_stage(seconds, items, size, digest=None):
+    result = {
+        'seconds': round(seconds, 4),
+        'items': items,
+        'bytes': size,
+        'items_per_s': round(items / seconds, 1) if seconds else None,
+        'mb_per_s': round(size / MB / seconds, 3) if seconds else None,
+    }
+    if digest:
+        result['digest'] = digest
+    return result
+
+
+def check_digests(file_name, params, results):
+    """Compares output digests with previously saved results. Returns
+    False if any of them differs."""
+    with io.open(file_name, encoding='utf-8') as f:
+        saved = json.load(f)
+    if saved['dump']['params'] != json.loads(json.dumps(params)):
+        print('Warning: %s was produced for another dump' % file_name)
+    success = True
+    for name, stage in sorted(results.items()):
+        expected = saved['stages'].get(name, {}).get('digest', None)
+        if expected and 'digest' in stage:
+            same = expected == stage['digest']
+            print('%-8s output %s' % (name, 'is identical' if same
+                                      else 'differs from ' + file_name))
+            success = success and same
+    return success
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    wxrgen.add_arguments(parser)
+    parser.add_argument(
+        '--dump',
+        metavar='FILE',
+        default=None,
+        help='use existing dump instead of generating one')
+    parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=3,
+        help='runs per stage, the best time is used (default: %(default)s)')
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='worker processes for the end-to-end export')
+    parser.add_argument(
+        '--parallel-parse',
+        action='store_true',
+        default=False,
+        help='parse the dump in the worker processes for the export')
+    parser.add_argument(
+        '--ref-links',
+        action='store_true',
+        default=False,
+        help='generate reference links instead of inline')
+    parser.add_argument(
+        '--stages',
+        default='export,parse,html2md,dump',
+        help='comma-separated list of stages to run')
+    parser.add_argument(
+        '--check',
+        metavar='FILE',
+        default=None,
+        help='compare output digests with saved results')
+    parser.add_argument(
+        '-o',
+        metavar='FILE',
+        default=None,
+        help='save results to JSON file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    errors = ErrorCounter()
+    logging.getLogger(wp2md.__name__).addHandler(errors)
+
+    work_dir = tempfile.mkdtemp(prefix='wp2md-bench-')
+    try:
+        file_name = args.dump
+        params = None
+        if not file_name:
+            params = wxrgen.get_options(args)
+            file_name = os.path.join(work_dir, 'dump.xml')
+            wxrgen.generate(file_name, **params)
+            params['mix'] = params['mix'] or wxrgen.MIX
+        size = os.path.getsize(file_name)
+        print('Dump: %s (%.2f MB)' % (args.dump or 'generated', size / MB))
+
+        options = {'jobs': args.jobs, 'ref_links': args.ref_links}
+        stages = {
+            'export': lambda: bench_export(
+                file_name, work_dir,
+                dict(options, parallel_parse=args.parallel_parse),
+                args.repeat),
+            'parse': lambda: bench_parse(file_name, options, args.repeat),
+            'html2md': lambda: bench_html2md(file_name, options, args.repeat),
+            'dump': lambda: bench_dump(file_name, work_dir, options,
+                                       args.repeat),
+        }
+
+        results = {}
+        for name in args.stages.split(','):
+            stage = get_stage(*stages[name]())
+            results[name] = stage
+            print('%-8s %8.3f s %8d items %10.1f items/s %8.2f MB/s' % (
+                  name, stage['seconds'], stage['items'],
+                  stage['items_per_s'] or 0, stage['mb_per_s'] or 0))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if errors.count:
+        print('Errors logged: %d' % errors.count)
+
+    if args.o:
+        report = {
+            'version': get_version(),
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'dump': {
+                'file': args.dump,
+                'bytes': size,
+                'params': params,
+            },
+            'repeat': args.repeat,
+            'jobs': args.jobs,
+            'ref_links': args.ref_links,
+            'parallel_parse': args.parallel_parse,
+            'errors': errors.count,
+            'stages': results,
+        }
+        with io.open(args.o, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, indent=2, sort_keys=True,
+                               ensure_ascii=False))
+        print('Results saved to %s' % args.o)
+
+    if args.check and not check_digests(args.check, params, results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Per-document HTML2Text overhead: new instance vs reset() reuse."""
+
+import timeit
+from wp2md import html2text
+
+COMMENT = 'Thanks, <b>great</b> post!'
+NUMBER = 2000
+REPEAT = 20
+
+
+def convert_new(html):
+    h2t = html2text.HTML2Text()
+    h2t.unicode_snob = True
+    h2t.body_width = 0
+    return h2t.handle(html)
+
+
+def make_convert_reuse():
+    h2t = html2text.HTML2Text()
+    h2t.unicode_snob = True
+    h2t.body_width = 0
+
+    def convert_reuse(html):
+        h2t.reset()
+        return h2t.handle(html)
+
+    return convert_reuse
+
+
+def measure(funcs, html, number=NUMBER, repeat=REPEAT):
+    """Returns per-document conversion times in microseconds for each
+    function, the best of @repeat runs. The runs are interleaved, so
+    the functions are compared under the same system load."""
+    best = [None] * len(funcs)
+    for i in range(repeat):
+        for index, func in enumerate(funcs):
+            seconds = timeit.timeit(lambda: func(html), number=number)
+            if best[index] is None or seconds < best[index]:
+                best[index] = seconds
+    return [seconds * 1e6 / number for seconds in best]
+
+
+def main():
+    convert_reuse = make_convert_reuse()
+    assert convert_new(COMMENT) == convert_reuse(COMMENT)
+
+    new, reuse = measure([convert_new, convert_reuse], COMMENT)
+    empty_new, empty_reuse = measure([convert_new, convert_reuse], '')
+
+    print('Document: %r (best of %d x %d conversions)' % (COMMENT, REPEAT,
+                                                         NUMBER))
+    print('new instance:   %8.2f us/doc (%.2f us overhead)' % (new, empty_new))
+    print('reset() reuse:  %8.2f us/doc (%.2f us overhead)' % (reuse, empty_reuse))
+    print('speedup:        %8.2fx' % (new / reuse))
+
+
+if __name__ == '__main__':
+    main()
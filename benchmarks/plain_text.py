@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Markup-free text conversion: HTML2Text vs text2md() fast path.
+
+The fast path output is checked against HTML2Text for generated texts
+and the corner cases before measuring."""
+
+import timeit
+from wp2md import html2text
+from .wxrgen import Generator
+
+CASES = [
+    u'',
+    u'   ',
+    u'word',
+    u' leading and trailing space ',
+    u'line\nbreak\n\nparagraph\r\nwindows',
+    u'1. ordered\n  2. indented\n+ plus\n- dash\n* star\n-- not a list',
+    u'back\\slash [brackets] (parens) *stars* _under_ `tick` #hash !bang',
+    u'1999. was a year\n3.14 is not a list',
+    u'non-breaking\xa0space em space\ttab',
+    u'привет мир',
+    u'> not a quote\n    not code',
+    u'ends with newline\n',
+]
+SAMPLES = 2000
+NUMBER = 5
+
+
+def convert_parser(text, snob=False):
+    h2t = html2text.HTML2Text()
+    h2t.body_width = 0
+    h2t.escape_snob = snob
+    return h2t.handle(text)
+
+
+def get_texts():
+    gen = Generator(seed=1, mix=[('plain', 1)])
+    texts = [gen.html(gen.random.randint(10, 2000)) for i in range(SAMPLES)]
+    return CASES + texts
+
+
+def check(texts):
+    """Makes sure text2md() output is the same as HTML2Text one."""
+    for text in texts:
+        assert html2text.is_markup_free(text)
+        for snob in [False, True]:
+            expected = convert_parser(text, snob)
+            result = html2text.text2md(text, snob)
+            assert result == expected, (text, snob, expected, result)
+
+
+def measure(func, texts, number=NUMBER):
+    """Returns per-document conversion time in microseconds."""
+    def run():
+        for text in texts:
+            func(text)
+    return timeit.timeit(run, number=number) * 1e6 / number / len(texts)
+
+
+def main():
+    texts = get_texts()
+    check(texts)
+    parser = measure(convert_parser, texts)
+    fast = measure(html2text.text2md, texts)
+
+    print('%d markup-free documents, output is identical' % len(texts))
+    print('HTML2Text:  %8.2f us/doc' % parser)
+    print('text2md():  %8.2f us/doc' % fast)
+    print('speedup:    %8.2fx' % (parser / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+"""Synthetic WordPress WXR dump generator.
+
+Usage example: python -m benchmarks.wxrgen dump.xml --posts 5000 --comments 10
+
+Generated dumps are deterministic for the same parameters and seed."""
+
+import argparse
+import io
+import random
+
+# Content block types and default weights of the markup mix
+MIX = [
+    ('p', 6),
+    ('plain', 2),
+    ('links', 2),
+    ('ul', 1),
+    ('ol', 1),
+    ('bq', 1),
+    ('pre', 1),
+    ('h', 1),
+    ('img', 1),
+    ('entities', 1),
+]
+
+HEADER = u'''<?xml version="1.0" encoding="UTF-8" ?>
+<rss version="2.0"
+\txmlns:excerpt="http://wordpress.org/export/1.2/excerpt/"
+\txmlns:content="http://purl.org/rss/1.0/modules/content/"
+\txmlns:wfw="http://wellformedweb.org/CommentAPI/"
+\txmlns:dc="http://purl.org/dc/elements/1.1/"
+\txmlns:wp="http://wordpress.org/export/1.2/"
+>
+<channel>
+\t<title>Synthetic Blog</title>
+\t<link>{url}</link>
+\t<description>Generated benchmark dump</description>
+\t<pubDate>Tue, 01 Jan 2013 10:00:00 +0000</pubDate>
+\t<language>en</language>
+\t<wp:wxr_version>1.2</wp:wxr_version>
+\t<wp:base_site_url>{url}</wp:base_site_url>
+\t<wp:base_blog_url>{url}</wp:base_blog_url>
+\t<wp:author><wp:author_id>1</wp:author_id><wp:author_login>admin</wp:author_login><wp:author_email>admin@example.com</wp:author_email><wp:author_display_name><![CDATA[Admin]]></wp:author_display_name></wp:author>
+'''
+
+FOOTER = u'''
+</channel>
+</rss>
+'''
+
+ITEM = u'''
+\t<item>
+\t\t<title>{title}</title>
+\t\t<link>{url}/?p={id}</link>
+\t\t<pubDate>Thu, 01 Mar 2012 10:00:00 +0000</pubDate>
+\t\t<dc:creator>admin</dc:creator>
+\t\t<guid isPermaLink="false">{url}/?p={id}</guid>
+\t\t<description></description>
+\t\t<content:encoded><![CDATA[{content}]]></content:encoded>
+\t\t<excerpt:encoded><![CDATA[{excerpt}]]></excerpt:encoded>
+\t\t<wp:post_id>{id}</wp:post_id>
+\t\t<wp:post_date>{date} 10:{minute:02d}:00</wp:post_date>
+\t\t<wp:post_date_gmt>{date} 07:{minute:02d}:00</wp:post_date_gmt>
+\t\t<wp:comment_status>open</wp:comment_status>
+\t\t<wp:ping_status>open</wp:ping_status>
+\t\t<wp:post_name>{name}</wp:post_name>
+\t\t<wp:status>{status}</wp:status>
+\t\t<wp:post_parent>0</wp:post_parent>
+\t\t<wp:menu_order>0</wp:menu_order>
+\t\t<wp:post_type>{type}</wp:post_type>
+\t\t<wp:post_password></wp:post_password>
+\t\t<wp:is_sticky>0</wp:is_sticky>
+\t\t<wp:postmeta>
+\t\t\t<wp:meta_key>_edit_last</wp:meta_key>
+\t\t\t<wp:meta_value><![CDATA[1]]></wp:meta_value>
+\t\t</wp:postmeta>{comments}
+\t</item>'''
+
+COMMENT = u'''
+\t\t<wp:comment>
+\t\t\t<wp:comment_id>{id}</wp:comment_id>
+\t\t\t<wp:comment_author><![CDATA[Reader {author}]]></wp:comment_author>
+\t\t\t<wp:comment_author_email>reader{author}@example.com</wp:comment_author_email>
+\t\t\t<wp:comment_author_url>http://reader{author}.example.com</wp:comment_author_url>
+\t\t\t<wp:comment_author_IP>127.0.0.1</wp:comment_author_IP>
+\t\t\t<wp:comment_date>{date} 12:00:00</wp:comment_date>
+\t\t\t<wp:comment_date_gmt>{date} 09:00:00</wp:comment_date_gmt>
+\t\t\t<wp:comment_content><![CDATA[{content}]]></wp:comment_content>
+\t\t\t<wp:comment_approved>{approved}</wp:comment_approved>
+\t\t\t<wp:comment_type>{type}</wp:comment_type>
+\t\t\t<wp:comment_parent>0</wp:comment_parent>
+\t\t\t<wp:comment_user_id>0</wp:comment_user_id>
+\t\t</wp:comment>'''
+
+WORDS = (u'lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         u'eiusmod tempor incididunt ut labore et dolore magna aliqua '
+         u'привет мир export markdown wordpress 1. * _ [note] 2012').split()
+
+BASE_URL = 'http://example.com'
+
+
+class Generator(object):
+    """Generates random content with the specified markup mix."""
+
+    def __init__(self, seed=0, mix=None, links=20):
+        self.random = random.Random(seed)
+        mix = mix or MIX
+        self.blocks = [name for name, weight in mix for i in range(weight)]
+        # Reference-heavy posts reuse the same link targets
+        self.urls = ['%s/page/%d/' % (BASE_URL, i) for i in range(links)]
+        self.urls += ['http://site%d.example.org/' % i for i in range(links)]
+
+    def text(self, words):
+        return u' '.join(self.random.choice(WORDS) for i in range(words))
+
+    def link(self):
+        url = self.random.choice(self.urls)
+        title = self.random.choice(['', ' title="Link title"'])
+        return u'<a href="%s"%s>%s</a>' % (url, title, self.text(2))
+
+    def block(self, kind):
+        rnd = self.random
+        if kind == 'p':
+            return u'<p>%s <em>%s</em> %s</p>' % (self.text(20), self.text(3),
+                                                self.text(20))
+        if kind == 'plain':
+            return u'%s\n%s\n' % (self.text(25), self.text(10))
+        if kind == 'links':
+            parts = [u'%s %s' % (self.text(4), self.link()) for i in range(5)]
+            return u'<p>%s</p>' % u' '.join(parts)
+        if kind in ['ul', 'ol']:
+            items = [u'<li>%s</li>' % self.text(8)
+                     for i in range(rnd.randint(2, 6))]
+            return u'<%s>%s</%s>' % (kind, u''.join(items), kind)
+        if kind == 'bq':
+            inner = u'<blockquote>%s</blockquote>' % self.text(10)
+            return u'<blockquote><p>%s</p>%s</blockquote>' % (self.text(15),
+                                                             inner)
+        if kind == 'pre':
+            lines = [u'    %s = %d' % (rnd.choice(WORDS), rnd.randint(0, 99))
+                     for i in range(rnd.randint(2, 8))]
+            return u'<pre>def f():\n%s</pre>' % u'\n'.join(lines)
+        if kind == 'h':
+            return u'<h%d>%s</h%d>' % (rnd.randint(2, 4), self.text(4),
+                                       rnd.randint(2, 4))
+        if kind == 'img':
+            return u'<p><img src="%s/img/%d.png" alt="%s" /></p>' % \
+                (BASE_URL, rnd.randint(0, 999), self.text(2))
+        if kind == 'entities':
+            return u'<p>%s &copy; &mdash; &#1055;&#1088; &amp; &lt;%s&gt;</p>' \
+                % (self.text(10), self.text(1))
+        raise ValueError('Unknown block type: ' + kind)
+
+    def html(self, size):
+        """Returns HTML fragment of approximately @size characters."""
+        blocks = []
+        length = 0
+        while length < size:
+            block = self.block(self.random.choice(self.blocks))
+            blocks.append(block)
+            length += len(block) + 1
+        return u'\n'.join(blocks)
+
+    def comment(self, comment_id, date):
+        rnd = self.random
+        return COMMENT.format(
+            id=comment_id,
+            author=rnd.randint(1, 50),
+            date=date,
+            content=self.html(rnd.randint(50, 400)),
+            approved=rnd.choice(['1', '1', '1', '0']),
+            type=rnd.choice(['', '', '', 'pingback']))
+
+    def item(self, post_id, item_type, status, size, comments):
+        day = post_id % 28 + 1
+        date = '2012-%02d-%02d' % (post_id % 12 + 1, day)
+        cmnts = [self.comment(post_id * 1000 + i, date)
+                 for i in range(comments)]
+        return ITEM.format(
+            title=u'%s %d' % (self.text(4).title(), post_id),
+            url=BASE_URL,
+            id=post_id,
+            content=self.html(size),
+            excerpt=self.text(10) if post_id % 5 == 0 else u'',
+            date=date,
+            minute=post_id % 60,
+            name=u'post-%d' % post_id if post_id % 10 else u'',
+            status=status,
+            type=item_type,
+            comments=u''.join(cmnts))
+
+    def attachment(self, post_id):
+        """Returns media library item with the metadata, like the ones
+        WordPress creates for each uploaded image."""
+        sizes = [u's:%d:"%s";a:3:{s:4:"file";s:20:"image-%dx%d.jpg";'
+                 u's:5:"width";i:%d;s:6:"height";i:%d;}' % (
+                     len(name), name, width, width, width, width)
+                 for name, width in [('thumbnail', 150), ('medium', 300),
+                                     ('large', 1024), ('post-thumbnail', 624)]]
+        meta = u'a:5:{s:5:"width";i:2048;s:6:"height";i:1536;s:4:"file";' \
+               u's:19:"2012/01/image-%d.jpg";s:5:"sizes";a:4:{%s}' \
+               u's:10:"image_meta";a:0:{}}' % (post_id, u''.join(sizes))
+        extra = (u'\n\t\t<wp:attachment_url>%s/wp-content/uploads/2012/01/'
+                 u'image-%d.jpg</wp:attachment_url>'
+                 u'\n\t\t<wp:postmeta>\n\t\t\t<wp:meta_key>'
+                 u'_wp_attachment_metadata</wp:meta_key>'
+                 u'\n\t\t\t<wp:meta_value><![CDATA[%s]]></wp:meta_value>'
+                 u'\n\t\t</wp:postmeta>') % (BASE_URL, post_id, meta)
+        return ITEM.format(
+            title=u'image-%d' % post_id,
+            url=BASE_URL,
+            id=post_id,
+            content=u'',
+            excerpt=self.text(5),
+            date='2012-01-01',
+            minute=0,
+            name=u'image-%d' % post_id,
+            status=u'inherit',
+            type=u'attachment',
+            comments=extra)
+
+
+def generate(file_name, posts=1000, pages=50, drafts=50, comments=5,
+             html_size=4000, large=0, large_size=256 * 1024, seed=0,
+             mix=None, attachments=None):
+    """Writes synthetic WXR dump to the file. @large posts have
+    @large_size characters of content to exceed the parser buffer size.
+    @attachments media items are distributed evenly between the others
+    (if not specified, an empty attachment follows every 20th item).
+    Returns the number of exported items."""
+
+    gen = Generator(seed, mix)
+    rnd = gen.random
+    items = [('post', 'publish')] * posts + [('page', 'publish')] * pages
+    items += [('post', 'draft')] * drafts
+    rnd.shuffle(items)
+    large_ids = set(rnd.sample(range(len(items)), min(large, len(items))))
+
+    with io.open(file_name, 'w', encoding='utf-8') as f:
+        f.write(HEADER.format(url=BASE_URL))
+        for index, (item_type, status) in enumerate(items):
+            size = large_size if index in large_ids else \
+                rnd.randint(html_size // 2, html_size * 3 // 2)
+            num = rnd.randint(0, comments * 2) if item_type == 'post' else 0
+            f.write(gen.item(index + 1, item_type, status, size, num))
+            if attachments is not None:
+                count = (index + 1) * attachments // len(items) - \
+                    index * attachments // len(items)
+                for i in range(count):
+                    attachment_id = len(items) + index * attachments + i + 1
+                    f.write(gen.attachment(attachment_id))
+            elif index % 20 == 0:
+                # Non-exported item types should be skipped by the parser
+                f.write(ITEM.format(title='Attachment', url=BASE_URL,
+                                    id=len(items) + index + 1, content='',
+                                    excerpt='', date='2012-01-01', minute=0,
+                                    name='attachment', status='inherit',
+                                    type='attachment', comments=''))
+        f.write(FOOTER)
+    return len(items)
+
+
+def parse_mix(value):
+    """Parses markup mix specification like 'p=5,pre=1,links=3'."""
+    known = dict(MIX)
+    result = []
+    for part in value.split(','):
+        name, weight = part.split('=')
+        if name not in known:
+            raise argparse.ArgumentTypeError('unknown block type: ' + name)
+        result.append((name, int(weight)))
+    return result
+
+
+def add_arguments(parser):
+    """Adds generator options to the argument parser."""
+    parser.add_argument(
+        '--posts',
+        type=int,
+        default=1000,
+        help='published posts number (default: %(default)s)')
+    parser.add_argument(
+        '--pages',
+        type=int,
+        default=50,
+        help='pages number (default: %(default)s)')
+    parser.add_argument(
+        '--drafts',
+        type=int,
+        default=50,
+        help='drafts number (default: %(default)s)')
+    parser.add_argument(
+        '--comments',
+        type=int,
+        default=5,
+        help='average comments per post (default: %(default)s)')
+    parser.add_argument(
+        '--html-size',
+        type=int,
+        default=4000,
+        help='average content size in characters (default: %(default)s)')
+    parser.add_argument(
+        '--large',
+        type=int,
+        default=2,
+        help='number of posts with large content (default: %(default)s)')
+    parser.add_argument(
+        '--large-size',
+        type=int,
+        default=256 * 1024,
+        help='large posts content size (default: %(default)s)')
+    parser.add_argument(
+        '--mix',
+        type=parse_mix,
+        default=None,
+        help='markup mix weights, e.g. p=5,links=2,ul=1,bq=1,pre=1')
+    parser.add_argument(
+        '--attachments',
+        type=int,
+        default=None,
+        help='number of media items (default: one per 20 items)')
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='random seed (default: %(default)s)')
+
+
+def get_options(args):
+    """Returns generate() keyword arguments from parsed arguments."""
+    return {
+        'posts': args.posts,
+        'pages': args.pages,
+        'drafts': args.drafts,
+        'comments': args.comments,
+        'html_size': args.html_size,
+        'large': args.large,
+        'large_size': args.large_size,
+        'seed': args.seed,
+        'mix': args.mix,
+        'attachments': args.attachments,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('file_name', help='output file name')
+    add_arguments(parser)
+    args = parser.parse_args()
+    count = generate(args.file_name, **get_options(args))
+    print('%d items written to %s' % (count, args.file_name))
+
+
+if __name__ == '__main__':
+    main()
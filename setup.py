@@ -16,7 +16,7 @@ setup(
     url=wp2md.authoring.__url__,
     long_description=open('README.md',"rb").read().decode('utf8'),
     platforms=['any'],
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     install_requires=[
       'markdown',
       'html2text'
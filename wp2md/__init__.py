@@ -0,0 +1,7 @@
+def convert(source, **options):
+    """Converts WordPress XML dump and returns a generator of records.
+    See wp2md.wp2md.convert() for details."""
+    # Imported on demand to keep package metadata importable
+    # without the dependencies installed
+    from .wp2md import convert
+    return convert(source, **options)
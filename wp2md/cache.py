@@ -0,0 +1,137 @@
+# coding: utf-8
+"""Persistent content-addressed cache for converted text.
+
+The cache is a single SQLite database file. Entries are keyed by a hash
+of the source text and conversion options, and evicted in least recently
+used order when the total size exceeds the limit. SQLite file locking
+makes the file safe to share between parallel worker processes, as long
+as each process opens its own ConversionCache instance.
+
+New entries and access time updates are buffered and written in a single
+transaction, so the processes do not wait for each other and for the
+disk on each conversion. Buffered changes are lost if the process is
+terminated without close()."""
+
+import hashlib
+import sqlite3
+import time
+
+DEFAULT_MAX_SIZE = 256  # Megabytes
+EVICTION_PERIOD = 1000  # Check size limit every N writes
+BATCH_SIZE = 100  # Buffered changes written in a single transaction
+LOCK_TIMEOUT = 60  # Seconds
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        atime REAL NOT NULL
+    )
+"""
+
+
+def make_key(*parts):
+    """Returns a hash for the source text and conversion options."""
+    digest = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = repr(part) if not isinstance(part, type(u'')) else part
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ConversionCache(object):
+    def __init__(self, file_name, max_size=DEFAULT_MAX_SIZE):
+        """Opens (or creates) cache file. @max_size is the size limit
+        for cached values in megabytes."""
+        self.max_size = max_size * 1024 * 1024
+        self.writes = 0
+        self.puts = {}  # Key to (value, atime) not written yet
+        self.atimes = {}  # Key to access time not written yet
+        self.db = sqlite3.connect(file_name, timeout=LOCK_TIMEOUT,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # Losing the latest entries on power failure is fine for a cache
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(SCHEMA)
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_atime '
+                        'ON entries (atime)')
+
+    def get(self, key):
+        """Returns cached value or None."""
+        if key in self.puts:
+            value, atime = self.puts[key]
+            self.puts[key] = (value, time.time())
+            return value
+        row = self.db.execute('SELECT value FROM entries WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        self.atimes[key] = time.time()
+        self.changed()
+        return row[0]
+
+    def put(self, key, value):
+        """Stores value to the cache."""
+        self.puts[key] = (value, time.time())
+        self.atimes.pop(key, None)
+        self.changed()
+        self.writes += 1
+        if self.writes % EVICTION_PERIOD == 0:
+            self.flush()
+            self.evict()
+
+    def changed(self):
+        if len(self.puts) + len(self.atimes) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered entries and access times."""
+        if not self.puts and not self.atimes:
+            return
+        entries = [(key, value, len(value), atime)
+                   for key, (value, atime) in self.puts.items()]
+        atimes = [(atime, key) for key, atime in self.atimes.items()]
+        self.puts = {}
+        self.atimes = {}
+        self.execute_batch([
+            ('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', entries),
+            ('UPDATE entries SET atime = ? WHERE key = ?', atimes),
+        ])
+
+    def execute_batch(self, statements):
+        """Executes (sql, parameters list) pairs in a single transaction."""
+        self.db.execute('BEGIN')
+        try:
+            for sql, params in statements:
+                if params:
+                    self.db.executemany(sql, params)
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def evict(self):
+        """Drops least recently used entries exceeding the size limit."""
+        total = self.db.execute('SELECT SUM(size) FROM entries').fetchone()[0]
+        if not total or total <= self.max_size:
+            return
+        excess = total - self.max_size
+        rows = self.db.execute('SELECT key, size FROM entries '
+                               'ORDER BY atime')
+        keys = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        rows.close()
+        self.execute_batch([('DELETE FROM entries WHERE key = ?', keys)])
+
+    def close(self):
+        self.flush()
+        self.evict()
+        self.db.close()
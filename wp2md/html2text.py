@@ -40,6 +40,7 @@ import sys
 PY2 = sys.version_info[0] == 2
 
 strtype = unicode if PY2 else str
+chrtype = unichr if PY2 else chr
 
 # Use Unicode characters instead of their ascii psuedo-replacements
 UNICODE_SNOB = 0
@@ -88,10 +89,17 @@ unifiable = {'rsquo':"'", 'lsquo':"'", 'rdquo':'"', 'ldquo':'"',
 'ugrave':'u', 'uacute':'u', 'ucirc':'u', 'uuml':'u',
 'lrm':'', 'rlm':''}
 
-unifiable_n = {}
+# Lookup tables are built once and never modified, so converters could be
+# used from several threads. Non-breaking spaces are kept as a placeholder
+# replaced in close(), because they should survive whitespace collapsing.
+unifiable_n = dict((name2cp(k), v) for k, v in unifiable.items() if k != 'nbsp')
+unifiable = dict(unifiable, nbsp='&nbsp_place_holder;')
 
-for k in unifiable.keys():
-    unifiable_n[name2cp(k)] = unifiable[k]
+# Entity name to text mapping for unicode_snob mode and the default one
+entity_chars = dict((k, chrtype(name2cp(k))) for k in htmlentitydefs.name2codepoint)
+entity_chars['apos'] = "'"
+entity_chars_unified = dict(entity_chars, **unifiable)
+nbsp_char = chrtype(name2cp('nbsp'))
 
 ### End Entity Nonsense ###
 
@@ -177,6 +185,11 @@ def google_fixed_width_font(style):
         return True
     return False
 
+def link_key(attrs):
+    """Returns reference link index key. Links are the same if they have
+    equal hrefs and either equal titles or no titles at all."""
+    return attrs.get('href', None), has_key(attrs, 'title'), attrs.get('title', None)
+
 def list_numbering_start(attrs):
     """extract numbering from list element attributes"""
     if 'start' in attrs:
@@ -185,6 +198,8 @@ def list_numbering_start(attrs):
         return 0
 
 class HTML2Text(HTMLParser.HTMLParser):
+    absolute_url_matcher = re.compile(r'^[a-zA-Z+]+://')
+
     def __init__(self, out=None, baseurl=''):
         HTMLParser.HTMLParser.__init__(self)
 
@@ -209,6 +224,13 @@ class HTML2Text(HTMLParser.HTMLParser):
         else:
             self.out = out
 
+        self.baseurl = baseurl
+
+    def reset(self):
+        """Resets conversion state, so the instance could be reused for
+        another document with the same configuration."""
+        HTMLParser.HTMLParser.reset(self)
+
         self.outtextlist = []  # empty list to store output characters before they are "joined"
 
         try:
@@ -222,14 +244,15 @@ class HTML2Text(HTMLParser.HTMLParser):
         self.start = 1
         self.space = 0
         self.a = []
+        self.a_index = {}  # Reference links from self.a by link_key()
         self.astack = []
         self.maybe_automatic_link = None
-        self.absolute_url_matcher = re.compile(r'^[a-zA-Z+]+://')
         self.acount = 0
         self.list = []
         self.blockquote = 0
         self.pre = 0
         self.startpre = 0
+        self.update_indent()
         self.code = False
         self.br_toggle = ''
         self.lastWasNL = 0
@@ -243,12 +266,6 @@ class HTML2Text(HTMLParser.HTMLParser):
         self.abbr_title = None  # current abbreviation definition
         self.abbr_data = None  # last inner HTML (for abbr being defined)
         self.abbr_list = {}  # stack of abbreviations to write later
-        self.baseurl = baseurl
-
-        try: del unifiable_n[name2cp('nbsp')]
-        except KeyError: pass
-        unifiable['nbsp'] = '&nbsp_place_holder;'
-
 
     def feed(self, data):
         data = data.replace("</' + 'script>", "</ignore>")
@@ -271,10 +288,7 @@ class HTML2Text(HTMLParser.HTMLParser):
 
         self.outtext = self.outtext.join(self.outtextlist)
         if self.unicode_snob:
-            try:
-                nbsp = unichr(name2cp('nbsp'))
-            except:
-                nbsp = chr(name2cp('nbsp'))
+            nbsp = nbsp_char
         else:
             nbsp = strtype(' ')
         self.outtext = self.outtext.replace(strtype('&nbsp_place_holder;'), nbsp)
@@ -293,28 +307,24 @@ class HTML2Text(HTMLParser.HTMLParser):
     def handle_endtag(self, tag):
         self.handle_tag(tag, None, 0)
 
-    def previousIndex(self, attrs):
-        """ returns the index of certain set of attributes (of a link) in the
-            self.a list
-
-            If the set of attributes is not found, returns None
+    def reference_link(self, attrs):
+        """ returns the reference link previously added for the same
+            attributes (of a link), or adds a new one to the self.a list
         """
-        if not has_key(attrs, 'href'): return None
-
-        i = -1
-        for a in self.a:
-            i += 1
-            match = 0
-
-            if has_key(a, 'href') and a['href'] == attrs['href']:
-                if has_key(a, 'title') or has_key(attrs, 'title'):
-                        if (has_key(a, 'title') and has_key(attrs, 'title') and
-                            a['title'] == attrs['title']):
-                            match = True
-                else:
-                    match = True
-
-            if match: return i
+        if not has_key(attrs, 'href'):
+            link = None
+        else:
+            link = self.a_index.get(link_key(attrs), None)
+
+        if link is None:
+            self.acount += 1
+            attrs['count'] = self.acount
+            attrs['outcount'] = self.outcount
+            self.a.append(attrs)
+            if has_key(attrs, 'href'):
+                self.a_index[link_key(attrs)] = attrs
+            link = attrs
+        return link
 
     def drop_last(self, nLetters):
         if not self.quiet:
@@ -449,6 +459,7 @@ class HTML2Text(HTMLParser.HTMLParser):
             else:
                 self.blockquote -= 1
                 self.p()
+            self.update_indent()
 
         if tag in ['em', 'i', 'u'] and not self.ignore_emphasis: self.o(self.emphasis_mark)
         if tag in ['strong', 'b'] and not self.ignore_emphasis: self.o(self.strong_mark)
@@ -492,14 +503,7 @@ class HTML2Text(HTMLParser.HTMLParser):
                         if self.inline_links:
                             self.o("](" + escape_md(a['href']) + ")")
                         else:
-                            i = self.previousIndex(a)
-                            if i is not None:
-                                a = self.a[i]
-                            else:
-                                self.acount += 1
-                                a['count'] = self.acount
-                                a['outcount'] = self.outcount
-                                self.a.append(a)
+                            a = self.reference_link(a)
                             self.o("][" + str(a['count']) + "]")
 
         if tag == "img" and start and not self.ignore_images:
@@ -511,14 +515,7 @@ class HTML2Text(HTMLParser.HTMLParser):
                 if self.inline_links:
                     self.o("(" + escape_md(attrs['href']) + ")")
                 else:
-                    i = self.previousIndex(attrs)
-                    if i is not None:
-                        attrs = self.a[i]
-                    else:
-                        self.acount += 1
-                        attrs['count'] = self.acount
-                        attrs['outcount'] = self.outcount
-                        self.a.append(attrs)
+                    attrs = self.reference_link(attrs)
                     self.o("[" + str(attrs['count']) + "]")
 
         if tag == 'dl' and start: self.p()
@@ -539,6 +536,7 @@ class HTML2Text(HTMLParser.HTMLParser):
                 self.list.append({'name':list_style, 'num':numbering_start})
             else:
                 if self.list: self.list.pop()
+            self.update_indent()
             self.lastWasList = True
         else:
             self.lastWasList = False
@@ -568,8 +566,17 @@ class HTML2Text(HTMLParser.HTMLParser):
                 self.pre = 1
             else:
                 self.pre = 0
+            self.update_indent()
             self.p()
 
+    def update_indent(self):
+        """updates line prefixes for the blockquote depth and preformatted
+        text indentation (list content is already partially indented)"""
+        quote = ">" * self.blockquote
+        pre = "    " * (len(self.list) or 1) if self.pre else ""
+        self.indent = quote + (" " if self.blockquote else "") + pre
+        self.indent_nospace = quote + pre
+
     def pbr(self):
         if self.p_p == 0:
             self.p_p = 1
@@ -595,7 +602,7 @@ class HTML2Text(HTMLParser.HTMLParser):
                     self.drop_white_space = 0
 
             if puredata and not self.pre:
-                data = re.sub('\s+', ' ', data)
+                data = collapse_whitespace(data)
                 if data and data[0] == ' ':
                     self.space = 1
                     data = data[1:]
@@ -606,15 +613,12 @@ class HTML2Text(HTMLParser.HTMLParser):
                 if not data.startswith("\n"):  # <pre>stuff...
                     data = "\n" + data
 
-            bq = (">" * self.blockquote)
-            if not (force and data and data[0] == ">") and self.blockquote: bq += " "
+            if force and data and data[0] == ">":
+                bq = self.indent_nospace
+            else:
+                bq = self.indent
 
             if self.pre:
-                if not self.list:
-                    bq += "    "
-                #else: list content is already partially indented
-                for i in xrange(len(self.list)):
-                    bq += "    "
                 data = data.replace("\n", "\n"+bq)
 
             if self.startpre:
@@ -645,18 +649,21 @@ class HTML2Text(HTMLParser.HTMLParser):
             if self.a and ((self.p_p == 2 and self.links_each_paragraph) or force == "end"):
                 if force == "end": self.out("\n")
 
-                newa = []
+                # Links are added in outcount order, so the ones to print
+                # are always at the beginning of the list
+                printed = 0
                 for link in self.a:
-                    if self.outcount > link['outcount']:
-                        self.out("   ["+ str(link['count']) +"]: " + urlparse.urljoin(self.baseurl, link['href']))
-                        if has_key(link, 'title'): self.out(" ("+link['title']+")")
-                        self.out("\n")
-                    else:
-                        newa.append(link)
-
-                if self.a != newa: self.out("\n") # Don't need an extra line when nothing was done.
-
-                self.a = newa
+                    if self.outcount <= link['outcount']:
+                        break
+                    self.out("   ["+ str(link['count']) +"]: " + urlparse.urljoin(self.baseurl, link['href']))
+                    if has_key(link, 'title'): self.out(" ("+link['title']+")")
+                    self.out("\n")
+                    self.a_index.pop(link_key(link), None)
+                    printed += 1
+
+                if printed:
+                    self.out("\n") # Don't need an extra line when nothing was done.
+                    del self.a[:printed]
 
             if self.abbr_list and force == "end":
                 for abbr, definition in self.abbr_list.items():
@@ -693,25 +700,17 @@ class HTML2Text(HTMLParser.HTMLParser):
         else:
             c = int(name)
 
-        if not self.unicode_snob and c in unifiable_n.keys():
+        if not self.unicode_snob and c in unifiable_n:
             return unifiable_n[c]
         else:
-            try:
-                return unichr(c)
-            except NameError: #Python3
-                return chr(c)
+            return chrtype(c)
 
     def entityref(self, c):
-        if not self.unicode_snob and c in unifiable.keys():
-            return unifiable[c]
-        else:
-            try: name2cp(c)
-            except KeyError: return "&" + c + ';'
-            else:
-                try:
-                    return unichr(name2cp(c))
-                except NameError: #Python3
-                    return chr(name2cp(c))
+        table = entity_chars if self.unicode_snob else entity_chars_unified
+        try:
+            return table[c]
+        except KeyError:
+            return "&" + c + ";"
 
     def replaceEntities(self, s):
         s = s.group(1)
@@ -737,57 +736,49 @@ class HTML2Text(HTMLParser.HTMLParser):
             return text
 
         assert wrap, "Requires Python 2.3."
-        result = ''
+        result = []
         newlines = 0
         for para in text.split("\n"):
             if len(para) > 0:
                 if not skipwrap(para):
-                    result += "\n".join(wrap(para, self.body_width))
+                    result.append("\n".join(wrap(para, self.body_width)))
                     if para.endswith('  '):
-                        result += "  \n"
+                        result.append("  \n")
                         newlines = 1
                     else:
-                        result += "\n\n"
+                        result.append("\n\n")
                         newlines = 2
                 else:
                     if not onlywhite(para):
-                        result += para + "\n"
+                        result.append(para + "\n")
                         newlines = 1
             else:
                 if newlines < 2:
-                    result += "\n"
+                    result.append("\n")
                     newlines += 1
-        return result
+        return ''.join(result)
 
+whitespace_matcher = re.compile(r'\s+')
 ordered_list_matcher = re.compile(r'\d+\.\s')
 unordered_list_matcher = re.compile(r'[-\*\+]\s')
 md_chars_matcher = re.compile(r"([\\\[\]\(\)])")
-md_chars_matcher_all = re.compile(r"([`\*_{}\[\]\(\)#!])")
-md_dot_matcher = re.compile(r"""
-    ^             # start of line
-    (\s*\d+)      # optional whitespace and a number
-    (\.)          # dot
-    (?=\s)        # lookahead assert whitespace
-    """, re.MULTILINE | re.VERBOSE)
-md_plus_matcher = re.compile(r"""
-    ^
-    (\s*)
-    (\+)
-    (?=\s)
-    """, flags=re.MULTILINE | re.VERBOSE)
-md_dash_matcher = re.compile(r"""
-    ^
-    (\s*)
-    (-)
-    (?=\s|\-)     # followed by whitespace (bullet list, or spaced out hr)
-                  # or another dash (header or hr)
-    """, flags=re.MULTILINE | re.VERBOSE)
 slash_chars = r'\`*_{}[]()#+-.!'
-md_backslash_matcher = re.compile(r'''
-    (\\)          # match one slash
-    (?=[%s])      # followed by a char that requires escaping
-    ''' % re.escape(slash_chars),
-    flags=re.VERBOSE)
+# All the escaping rules in a single pattern, so the text is scanned once.
+# Each match is escaped by a backslash before its last character. Line
+# start rules match the preceding newline, so the text should be prefixed
+# with one (see escape_md_section()).
+md_section_pattern = r"""
+    \\(?=[%s])                    # slash followed by a char that requires escaping
+  | \n(?:\s*\d+\.|\s*\+)(?=\s)    # number and a dot, or plus at the line start
+                                  # followed by whitespace
+  | \n\s*-(?=\s|\-)               # dash at the line start followed by whitespace
+                                  # (bullet list, or spaced out hr) or another
+                                  # dash (header or hr)
+    """ % re.escape(slash_chars)
+md_section_matcher = re.compile(md_section_pattern, re.VERBOSE)
+md_section_matcher_all = re.compile(md_section_pattern + r"""
+  | [`\*_{}\[\]\(\)\#!]           # any markdown-sensitive character
+    """, re.VERBOSE)
 
 def skipwrap(para):
     # If the text begins with four spaces or one tab, it's a code block; don't wrap
@@ -825,19 +816,55 @@ def unescape(s, unicode_snob=False):
     h.unicode_snob = unicode_snob
     return h.unescape(s)
 
+def collapse_whitespace(text):
+    """Replaces whitespace runs with single spaces."""
+    if PY2 or not text:
+        # Python 2 regular expressions and str.split() disagree on
+        # what the whitespace is
+        return whitespace_matcher.sub(' ', text)
+    result = ' '.join(text.split())
+    if not result:
+        return ' '
+    if text[0].isspace():
+        result = ' ' + result
+    if text[-1].isspace():
+        result += ' '
+    return result
+
+def is_markup_free(text):
+    """Returns True if the text has no tags, entities or character
+    references, so text2md() could be used instead of HTML2Text."""
+    return '<' not in text and '&' not in text and r'\/script>' not in text
+
+def text2md(text, snob=False, body_width=0):
+    """Converts markup-free text to Markdown without running the parser.
+    The result is the same as HTML2Text.handle() output with the same
+    escape_snob and body_width values and other options at defaults: the
+    text is escaped and the whitespace is collapsed. Lines are wrapped
+    by the parser if body_width is not 0."""
+    if body_width:
+        h = HTML2Text()
+        h.escape_snob = snob
+        h.body_width = body_width
+        return h.handle(text)
+
+    text = collapse_whitespace(escape_md_section(text, snob=snob))
+    if text[:1] == ' ':
+        text = text[1:]
+    return text + '\n'
+
 def escape_md(text):
     """Escapes markdown-sensitive characters within other markdown constructs."""
     return md_chars_matcher.sub(r"\\\1", text)
 
 def escape_md_section(text, snob=False):
     """Escapes markdown-sensitive characters across whole document sections."""
-    text = md_backslash_matcher.sub(r"\\\1", text)
-    if snob:
-        text = md_chars_matcher_all.sub(r"\\\1", text)
-    text = md_dot_matcher.sub(r"\1\\\2", text)
-    text = md_plus_matcher.sub(r"\1\\\2", text)
-    text = md_dash_matcher.sub(r"\1\\\2", text)
-    return text
+    matcher = md_section_matcher_all if snob else md_section_matcher
+    return matcher.sub(escape_last_char, '\n' + text)[1:]
+
+def escape_last_char(match):
+    text = match.group()
+    return text[:-1] + '\\' + text[-1]
 
 
 def main():
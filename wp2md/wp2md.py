@@ -4,15 +4,27 @@
 import argparse
 import codecs
 import datetime
+import functools
+import heapq
+import json
 import logging
 import markdown
+import mmap
+import multiprocessing
 import os.path
 import re
 import sys
+import threading
 import time
 import traceback
-from xml.etree.ElementTree import XMLParser
+from collections import deque, OrderedDict
+from multiprocessing.util import Finalize
+from xml.etree.ElementTree import ParseError, XMLParser
 from . import html2text
+from .cache import ConversionCache, make_key, DEFAULT_MAX_SIZE
+from .version import get_version
+from .writers import FileWriter, ListWriter, StreamWriter, ThreadedWriter
+from .writers import get_archive_mode, make_archive_writer
 
 PY2 = sys.version_info[0] == 2
 
@@ -72,6 +84,21 @@ WHAT2SAVE = {
     ],
 }
 
+# Exported RSS item types, other items are skipped by the parser
+EXPORT_TYPES = ['post', 'page', 'draft']
+
+# Fields with a few distinct values shared between parsed records (the
+# shared values are kept until the end of parsing, so comment authors
+# are not included)
+SHARED_FIELDS = set([
+    'creator',
+    'comment_status',
+    'status',
+    'post_type',
+    'comment_approved',
+    'comment_type',
+])
+
 # Wordpress RSS items to public-static page header fields mapping
 # (undefined names will remain unchanged)
 FIELD_MAP = {
@@ -81,43 +108,135 @@ FIELD_MAP = {
 }
 
 DEFAULT_MAX_NAME_LEN = 50
+DEFAULT_CHUNK_SIZE = 64 * 1024
+JOBS_BACKLOG = 4  # Pending items per worker process
+SHARD_SIZE = 4 * 1024 * 1024  # Max dump part size for a parser process
 UNTITLED = 'untitled'
-MD_URL_RE = None
+MANIFEST_FILE = '.wp2md-manifest.json'
+DEFAULT_SLOWEST = 10
+
+# WordPress post and comment timestamps format, parsed without strptime()
+WP_DATE_FMT = "%Y-%m-%d %H:%M:%S"
+WP_DATE_RE = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2}) '
+                        r'([0-9]{2}):([0-9]{2}):([0-9]{2})\Z')
+DATES_CACHE_SIZE = 10000
+BAD_DATE = object()  # parse_date() memo value for unparsable dates
+
+# Item boundaries and the constructs which could contain them literally
+SHARD_MARKUP_RE = re.compile(br'<!\[CDATA\[|<!--|<item[\s>]|</item\s*>')
+CHANNEL_START_RE = re.compile(br'<channel(?:\s[^>]*)?>')
+
+# HTML tags except for Markdown autolinks
+HTML_TAG_RE = re.compile(r'<(?!(?:https?|ftp|mailto):)[a-zA-Z/!?]')
+
+# Timed processing stages and data size counters (see get_report())
+STAGES = ['feed', 'items', 'render', 'html2md', 'md2html', 'fix_urls', 'write']
+COUNTERS = ['read_bytes', 'html2md_bytes', 'md2html_bytes', 'write_bytes']
+
+# Configuration values affecting the output for a particular item
+OUTPUT_OPTIONS = [
+    'date_fmt',
+    'page_date_fmt',
+    'md_input',
+    'md_passthrough',
+    'ref_links',
+    'fix_urls',
+    'base_url',
+]
+
+# Default configuration (see parse_args() for the options description)
+DEFAULTS = {
+    'dump_path': '{year}{month}{day}_{source}',
+    'page_path': os.path.join("pages", "{name}.md"),
+    'post_path': os.path.join("posts", "{year}{month}{day}-{name}.md"),
+    'draft_path': "drafts/{name}.md",
+    'verbose': False,
+    'parse_date_fmt': "%a, %d %b %Y %H:%M:%S +0000",
+    'post_date_fmt': "%Y %H:%M:%S",
+    'date_fmt': WP_DATE_FMT,
+    'page_date_fmt': "%Y/%m/%d %H:%M:%S",
+    'file_date_fmt': "%Y%m%d",
+    'log_file': None,
+    'md_input': False,
+    'md_passthrough': False,
+    'max_name_len': DEFAULT_MAX_NAME_LEN,
+    'ref_links': False,
+    'fix_urls': True,
+    'base_url': None,
+    'chunk_size': DEFAULT_CHUNK_SIZE,
+    'jobs': 1,
+    'cache_file': None,
+    'cache_size': DEFAULT_MAX_SIZE,
+    'incremental': False,
+    'prune': False,
+    'write_thread': False,
+    'parallel_parse': False,
+    'ndjson': None,
+    'stats_json': None,
+    'slowest': DEFAULT_SLOWEST,
+}
 
 log = logging.getLogger(__name__)
-conf = {}
-stats = {
-    'page': 0,
-    'post': 0,
-    'comment': 0,
-}
+converters = threading.local()
+worker = None  # Exporter instance of a worker process
+tag_names = {}  # Expanded XML names to tag_name() results
+dates = {}  # Memoized parse_date() results (BAD_DATE for errors)
+timer = getattr(time, 'perf_counter', time.time)
 
 
 # Configuration and logging
 
 def init():
-    global conf
+    """Returns configuration for the command line arguments."""
     args = parse_args()
     init_logging(args.l, args.v)
-    conf = {
-        'source_file': args.source,
-        'dump_path': args.d,
-        'page_path': args.pg,
-        'post_path': args.ps,
-        'draft_path': args.dr,
-        'verbose': args.v,
-        'parse_date_fmt': args.u,
-        'post_date_fmt': args.o,
-        'date_fmt': args.f,
-        'page_date_fmt': args.ef,
-        'file_date_fmt': args.p,
-        'log_file': args.l,
-        'md_input': args.m,
-        'max_name_len': args.n,
-        'ref_links': args.r,
-        'fix_urls': args.url,
-        'base_url': args.b,
-    }
+    return make_conf(
+        args.source,
+        dump_path=args.d,
+        page_path=args.pg,
+        post_path=args.ps,
+        draft_path=args.dr,
+        verbose=args.v,
+        parse_date_fmt=args.u,
+        post_date_fmt=args.o,
+        date_fmt=args.f,
+        page_date_fmt=args.ef,
+        file_date_fmt=args.p,
+        log_file=args.l,
+        md_input=args.m,
+        md_passthrough=args.md_passthrough,
+        max_name_len=args.n,
+        ref_links=args.r,
+        fix_urls=args.url,
+        base_url=args.b,
+        chunk_size=args.c,
+        jobs=args.j,
+        cache_file=args.cache,
+        cache_size=args.cache_size,
+        incremental=args.incremental,
+        prune=args.prune,
+        write_thread=args.write_thread,
+        parallel_parse=args.parallel_parse,
+        ndjson=args.ndjson,
+        stats_json=args.stats_json,
+        slowest=args.slowest)
+
+
+def make_conf(source, **options):
+    """Returns validated configuration dictionary. Options are the keys
+    of DEFAULTS. @source is the dump file name or a file object."""
+    unknown = set(options) - set(DEFAULTS)
+    if unknown:
+        raise TypeError('Unknown options: ' + ', '.join(sorted(unknown)))
+
+    conf = dict(DEFAULTS)
+    conf.update(options)
+    if isinstance(source, (str_t, str)):
+        conf['source_file'] = source
+    else:
+        conf['source_file'] = getattr(source, 'name', 'stream')
+    conf['archive'] = bool(get_archive_mode(conf['dump_path']))
+    conf['records'] = False
 
     try:
         value = int(conf['max_name_len'])
@@ -128,6 +247,60 @@ def init():
         log.warn('Bad post name length limitation value. Using default.')
         conf['max_name_len'] = DEFAULT_MAX_NAME_LEN
 
+    try:
+        value = int(conf['chunk_size'])
+        if value <= 0:
+            raise ValueError()
+        conf['chunk_size'] = value
+    except:
+        log.warn('Bad input chunk size value. Using default.')
+        conf['chunk_size'] = DEFAULT_CHUNK_SIZE
+
+    try:
+        value = int(conf['jobs'])
+        if value < 0:
+            raise ValueError()
+        conf['jobs'] = value or multiprocessing.cpu_count()
+    except:
+        log.warn('Bad worker processes number. Using single process.')
+        conf['jobs'] = 1
+
+    try:
+        value = int(conf['cache_size'])
+        if value <= 0:
+            raise ValueError()
+        conf['cache_size'] = value
+    except:
+        log.warn('Bad cache size value. Using default.')
+        conf['cache_size'] = DEFAULT_MAX_SIZE
+
+    try:
+        value = int(conf['slowest'])
+        if value < 0:
+            raise ValueError()
+        conf['slowest'] = value
+    except:
+        log.warn('Bad slowest items number. Using default.')
+        conf['slowest'] = DEFAULT_SLOWEST
+
+    if conf['md_passthrough']:
+        conf['md_input'] = True
+
+    if conf['parallel_parse'] and conf['jobs'] < 2:
+        log.warn('Parallel parsing requires several worker processes.')
+        conf['parallel_parse'] = False
+
+    if (conf['archive'] or conf['ndjson']) and conf['incremental']:
+        log.warn('Incremental mode is supported for files output only.')
+        conf['incremental'] = False
+
+    if conf['write_thread'] and conf['incremental']:
+        # The manifest should only record the files actually written
+        log.warn('Background writing is not supported in incremental mode.')
+        conf['write_thread'] = False
+
+    return conf
+
 
 def init_logging(log_file, verbose):
     try:
@@ -171,43 +344,49 @@ def parse_args():
         '-d',
         action='store',
         metavar='PATH',
-        default='{year}{month}{day}_{source}',
-        help='destination path for generated files')
+        default=DEFAULTS['dump_path'],
+        help='destination path for generated files '
+             '(.tar, .tar.gz or .zip to write an archive)')
     parser.add_argument(
         '-u',
         action='store',
         metavar='FMT',
-        default="%a, %d %b %Y %H:%M:%S +0000",
+        default=DEFAULTS['parse_date_fmt'],
         help='<pubDate> date/time parsing format')
     parser.add_argument(
         '-o',
         action='store',
         metavar='FMT',
-        default="%Y %H:%M:%S",
+        default=DEFAULTS['post_date_fmt'],
         help='<wp:post_date> and <wp:post_date_gmt> parsing format')
     parser.add_argument(
         '-f',
         action='store',
         metavar='FMT',
-        default="%Y-%m-%d %H:%M:%S",
+        default=DEFAULTS['date_fmt'],
         help='date/time fields parsing format for input data')
     parser.add_argument(
         '-ef',
         action='store',
         metavar='FMT',
-        default="%Y/%m/%d %H:%M:%S",
+        default=DEFAULTS['page_date_fmt'],
         help='date/time fields format for generated pages')
     parser.add_argument(
         '-p',
         action='store',
         metavar='FMT',
-        default="%Y%m%d",
+        default=DEFAULTS['file_date_fmt'],
         help='date prefix format for generated files')
     parser.add_argument(
         '-m',
         action='store_true',
         default=False,
         help='preprocess content with Markdown (helpful for MD input)')
+    parser.add_argument(
+        '--md-passthrough',
+        action='store_true',
+        default=False,
+        help='keep MD input without HTML tags as is (implies -m)')
     parser.add_argument(
         '-n',
         action='store',
@@ -223,19 +402,19 @@ def parse_args():
         '-ps',
         action='store',
         metavar='PATH',
-        default=os.path.join("posts", "{year}{month}{day}-{name}.md"),
+        default=DEFAULTS['post_path'],
         help='post files path (see docs for variable names)')
     parser.add_argument(
         '-pg',
         action='store',
         metavar='PATH',
-        default=os.path.join("pages", "{name}.md"),
+        default=DEFAULTS['page_path'],
         help='page files path')
     parser.add_argument(
         '-dr',
         action='store',
         metavar='PATH',
-        default="drafts/{name}.md",
+        default=DEFAULTS['draft_path'],
         help='draft files path')
     parser.add_argument(
         '-url',
@@ -248,6 +427,71 @@ def parse_args():
         metavar='URL',
         default=None,
         help='base URL to subtract from hrefs (default is the root)')
+    parser.add_argument(
+        '-c',
+        action='store',
+        metavar='SIZE',
+        default=DEFAULT_CHUNK_SIZE,
+        help='input file reading chunk size in bytes')
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='j',
+        action='store',
+        metavar='N',
+        default=1,
+        help='worker processes for item conversion (0 for CPU count)')
+    parser.add_argument(
+        '--cache',
+        action='store',
+        metavar='FILE',
+        default=None,
+        help='conversion cache file to reuse results between runs')
+    parser.add_argument(
+        '--cache-size',
+        action='store',
+        metavar='MB',
+        default=DEFAULT_MAX_SIZE,
+        help='conversion cache size limit in megabytes')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        default=False,
+        help='update previous export skipping unchanged items')
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        default=False,
+        help='remove files of deleted items in incremental mode')
+    parser.add_argument(
+        '--write-thread',
+        action='store_true',
+        default=False,
+        help='write files in a background thread (single process mode, '
+             'not with --incremental)')
+    parser.add_argument(
+        '--parallel-parse',
+        action='store_true',
+        default=False,
+        help='parse parts of the dump file in the worker processes')
+    parser.add_argument(
+        '--ndjson',
+        action='store',
+        metavar='FILE',
+        default=None,
+        help="write JSON record per line instead of files ('-' for stdout)")
+    parser.add_argument(
+        '--stats-json',
+        action='store',
+        metavar='FILE',
+        default=None,
+        help='save processing stages timing and counters to JSON file')
+    parser.add_argument(
+        '--slowest',
+        action='store',
+        type=int,
+        metavar='N',
+        default=DEFAULT_SLOWEST,
+        help='number of the slowest items to report (default: %(default)s)')
     parser.add_argument(
         'source',
         action='store',
@@ -263,88 +507,64 @@ def getxm(message, exception):
 
 
 def tag_name(name):
-    """Removes expanded namespace from tag name."""
+    """Removes expanded namespace from tag name. Results are memoized,
+    since a dump contains a few dozens of distinct names."""
+    try:
+        return tag_names[name]
+    except KeyError:
+        pass
     result = name[name.find('}') + 1:]
     if result == 'encoded':
         if name.find('/content/') > -1:
             result = 'content'
         elif name.find('/excerpt/') > -1:
             result = 'excerpt'
+    tag_names[name] = result
     return result
 
 
 def parse_date(date_str, format, default=None):
     """Parses date string according to specified format."""
-    try:
-        result = time.strptime(date_str, format)
-    except:
+    key = (date_str, format)
+    result = dates.get(key, None)
+    if result is None:
+        try:
+            result = parse_time(date_str, format)
+        except:
+            # Failures are memoized too, e.g. drafts have zero GMT dates
+            result = BAD_DATE
+        if len(dates) >= DATES_CACHE_SIZE:
+            dates.clear()
+        dates[key] = result
+
+    if result is BAD_DATE:
         msg = "Error parsing date string '%s'. Using default value." % date_str
         log.debug(msg)
-        result = default
-
+        return default
     return result
 
 
-def get_path_fmt(item_type, data):
-    """Returns preconfigured export path format for specified
-    RSS item type and metadata."""
-
-    if data.get('status', None).lower() == 'draft':
-        return conf['draft_path']
-    is_post = item_type == 'post'
-    return conf['post_path'] if is_post else conf['page_path']
-
-
-def get_path(item_type, file_name=None, data=None):
-    """Generates full path for the generated file using configuration
-    and explicitly specified name or RSS item data. At least one argument
-    should be specified. @file_name has higher priority during output
-    path generation.
-
-    Arguments:
-        item_type -- 'post' or 'page'
-        file_name -- explicitly defined correct file name.
-        data -- preprocessed RSS item data dictionary."""
-
-    if not file_name and type(data) is not dict:
-        raise Exception('File name or RSS item data dict should be defined')
-
-    root = conf['dump_path']
-    root = root.format(date=time.strftime(conf['file_date_fmt']),
-                       year=time.strftime("%Y"),
-                       month=time.strftime("%m"),
-                       day=time.strftime("%d"),
-                       source=os.path.basename(conf['source_file']))
-
-    if file_name:
-        relpath = file_name
-    else:
-        name = data.get('post_name', '').strip()
-        name = name or data.get('post_id', UNTITLED)
-        relpath = get_path_fmt(item_type, data)
-        field = FIELD_MAP.get('post_date', 'post_date')
-        post_date = data[field]
-        relpath = relpath.format(year=time.strftime("%Y", post_date),
-                                 month=time.strftime("%m", post_date),
-                                 day=time.strftime("%d", post_date),
-                                 name=name,
-                                 title=name)
-
-    return uniquify(os.path.join(os.path.abspath(root), relpath))
-
-
-def uniquify(file_name):
-    """Inserts numeric suffix at the end of file name to make
-    it's name unique in the directory."""
-
-    suffix = 0
-    result = file_name
-    while True:
-        if os.path.exists(result):
-            suffix += 1
-            result = insert_suffix(file_name, suffix)
-        else:
-            return result
+def parse_time(date_str, format):
+    """time.strptime() with a fast path for WordPress timestamps."""
+    if format == WP_DATE_FMT:
+        match = WP_DATE_RE.match(date_str)
+        if match:
+            try:
+                parts = [int(value) for value in match.groups()]
+                return datetime.datetime(*parts).timetuple()
+            except ValueError:
+                # Leap seconds and the like are left to strptime()
+                pass
+    return time.strptime(date_str, format)
+
+
+def date_parts(value):
+    """Returns year, month and day path components for the time tuple."""
+    return {
+        'year': str(value.tm_year),
+        'month': '%02d' % value.tm_mon,
+        'day': '%02d' % value.tm_mday,
+    }
 
 
 def insert_suffix(file_name, suffix):
@@ -367,56 +587,103 @@ def insert_suffix(file_name, suffix):
     return "%s-%s%s" % (base, suffix, ext)
 
 
-# Markdown processing and generation
+def read_chunks(source, chunk_size):
+    """Reads file by fixed-size chunks, so the whole dump is never loaded
+    to memory at once. @source is a file name or a binary file object."""
+    if isinstance(source, (str_t, str)):
+        with open(source, 'rb') as f:
+            for chunk in read_chunks(f, chunk_size):
+                yield chunk
+        return
 
-def html2md(html):
-    h2t = html2text.HTML2Text()
-    h2t.unicode_snob = True
-    h2t.inline_links = not conf['ref_links']
-    h2t.body_width = 0
-    return h2t.handle(html).strip()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def find_shards(data, shard_size):
+    """Splits the items of WXR dump @data (bytes or mmap) to the ranges
+    of about @shard_size bytes at the item boundaries. CDATA sections and
+    comments are skipped, since they could contain item tags literally.
+    Returns the list of (start, end) offsets. The first range starts at
+    the first item, the last one ends after the last item. The list is
+    empty if there are no items or the last one is not closed."""
+    shards = []
+    start = end = None
+    depth = 0
+    pos = 0
+    while True:
+        match = SHARD_MARKUP_RE.search(data, pos)
+        if not match:
+            break
+        token = match.group()
+        if token in [b'<![CDATA[', b'<!--']:
+            closing = b']]>' if token == b'<![CDATA[' else b'-->'
+            pos = data.find(closing, match.end())
+            if pos < 0:
+                return []
+            pos += len(closing)
+        elif token.startswith(b'</'):
+            pos = match.end()
+            depth = max(depth - 1, 0)
+            if not depth:
+                end = pos
+        else:
+            pos = match.end()
+            if not depth:
+                if start is None:
+                    start = match.start()
+                elif match.start() - start >= shard_size:
+                    shards.append((start, match.start()))
+                    start = match.start()
+            depth += 1
 
+    if start is None or depth or end < start:
+        return []
+    shards.append((start, end))
+    return shards
 
-def generate_toc(meta, items):
-    """Generates MD-formatted index page."""
-    if not meta.get('description', ''):
-        content = '\n\n'
-    else:
-        content = meta.get('description', '') + '\n\n'
-    for item in items:
-        content += str_t("* {post_date}: [{title}]({link})\n").format(**item)
-    return content
 
+# Markdown processing and generation
 
-def generate_comments(comments):
-    """Generates MD-formatted comments list from parsed data."""
+def get_converter(**options):
+    """Returns HTML2Text instance configured with specified options.
+    Converters are created once per options set and reused within
+    the thread after reset()."""
+    pool = converters.__dict__
+    key = tuple(sorted(options.items()))
+    h2t = pool.get(key, None)
+    if h2t is None:
+        h2t = html2text.HTML2Text()
+        for option, value in options.items():
+            setattr(h2t, option, value)
+        pool[key] = h2t
+    else:
+        h2t.reset()
+    return h2t
 
-    result = str_t('')
-    for comment in comments:
-        try:
-            approved = comment['comment_approved'] == '1'
-            pingback = comment.get('comment_type', '').lower() == 'pingback'
-            if approved and not pingback:
-                cmfmt = str_t("**[{author}](#{id} \"{timestamp}\"):** {content}\n\n")
-                content = html2md(comment['comment_content'])
-                result += cmfmt.format(id=comment['comment_id'],
-                                       timestamp=comment['comment_date'],
-                                       author=comment['comment_author'],
-                                       content=content)
-        except:
-            # Ignore malformed data
-            pass
 
-    return result and str_t("## Comments\n\n" + result)
+def convert_md(text):
+    """Converts Markdown to HTML. Markdown instance is created once
+    per thread and reset() before each conversion."""
+    md = getattr(converters, 'markdown', None)
+    if md is None:
+        md = converters.markdown = markdown.Markdown(extensions=[])
+    else:
+        md.reset()
+    return md.convert(text)
 
 
-def fix_urls(text):
-    """Removes base_url prefix from MD links and image sources."""
-    global MD_URL_RE
-    if MD_URL_RE is None:
-        base_url = re.escape(conf['base_url'])
-        MD_URL_RE = re.compile(r'\]\(%s(.*)\)' % base_url)
-    return MD_URL_RE.sub(r'](\1)', text)
+def generate_toc(meta, items):
+    """Generates MD-formatted index page."""
+    content = [meta.get('description', '') or '', '\n\n']
+    line_fmt = str_t("* {post_date}: [{title}]({link})\n")
+    content.extend(line_fmt.format(post_date=item.post_date,
+                                   title=item.title,
+                                   link=item.link) for item in items)
+    return ''.join(content)
 
 
 # Statistics
@@ -434,236 +701,1144 @@ def stopwatch_get():
     return ('0' + delta) if delta[0] == '.' else delta
 
 
-def statplusplus(field, value=1):
-    global stats
-    if field in stats:
-        stats[field] += value
-    else:
-        raise ValueError("Illegal name for stats field: " + str(field))
-
-
-# Parser data handlers
-
-def dump_channel(meta, items):
-    """Dumps RSS channel metadata and items index."""
-    file_name = get_path('page', 'index.md')
-    log.info("Dumping index to '%s'" % file_name)
-    fields = WHAT2SAVE['channel']
-    meta = {field: meta.get(field, None) for field in fields}
-
-    # Append export_date
-    pub_date = meta.get('pubDate', None)
-    format = conf['parse_date_fmt']
-    meta['export_date'] = parse_date(pub_date, format, time.gmtime())
-
-    # Append table of contents
-    meta['content'] = generate_toc(meta, items)
-
-    dump(file_name, meta, fields)
-
+def make_stats():
+    """Returns empty statistics dictionary."""
+    stats = {
+        'page': 0,
+        'post': 0,
+        'comment': 0,
+        'cache_hit': 0,
+        'cache_miss': 0,
+        'unchanged': 0,
+        'deleted': 0,
+        'plain_text': 0,
+        'md_passthrough': 0,
+    }
+    for stage in STAGES:
+        stats[stage + '_time'] = 0.0
+    for counter in COUNTERS:
+        stats[counter] = 0
+    return stats
+
+
+def timed(stage):
+    """Decorator adding Exporter method run time to the stage timer."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args):
+            started = timer()
+            try:
+                return method(self, *args)
+            finally:
+                self.stats[stage + '_time'] += timer() - started
+        return wrapper
+    return decorator
+
+
+# Library API
+
+def convert(source, **options):
+    """Converts WordPress XML dump and returns a generator of records,
+    one for each exported post, page or draft, with the channel metadata
+    and the index as the last record. Records are ordered dictionaries
+    with the same fields as NDJSON output lines.
 
-def dump_item(data):
-    """Dumps RSS channel item."""
-    if not 'post_type' in data:
-        log.error('Malformed RSS item: item type is not specified.')
-        return
+    Arguments:
+        source -- dump file name or binary file object.
+        options -- configuration values, see DEFAULTS for the names.
+            The dump_path and file path formats are only used to
+            generate file names in the records order."""
+    conf = make_conf(source, **options)
+    conf['records'] = True
+    conf['incremental'] = False
+    return Exporter(conf, source).process()
+
+
+# The Exporter
+
+class Exporter(object):
+    """Keeps configuration and state of a single export run.
+    Several exporters could be used within the same process."""
+
+    def __init__(self, conf, source=None):
+        self.conf = conf
+        self.source = source if source is not None else conf['source_file']
+        self.stats = make_stats()
+        self.slowest = []  # Heap of (seconds, post_id, file_name)
+        self.md_url_re = None
+        self.root = None
+        self.cache = None
+        self.writer = None
+        self.manifest = None
+        self.seen_items = set()
+        self.dir_index = {}
+        self.next_suffix = {}
+        self.workers = None
+        self.pending = deque()
+
+    def process(self):
+        """Parses the dump. Generates records collected by the output
+        writer (if any) after each input chunk."""
+        conf = self.conf
+        if conf['incremental']:
+            self.load_manifest()
+
+        success = False
+        target = CustomParser(self)
+        parser = XMLParser(target=target)
+        try:
+            sharded = conf['parallel_parse'] and self.get_shards()
+            if sharded:
+                for record in self.process_shards(parser, target, *sharded):
+                    yield record
+            else:
+                for chunk in read_chunks(self.source, conf['chunk_size']):
+                    self.feed(parser, chunk)
+                    for record in self.take_records():
+                        yield record
+            started = timer()
+            parser.close()
+            self.statplusplus('feed_time', timer() - started)
+            self.drain()
+            for record in self.take_records():
+                yield record
+            success = True
+        finally:
+            self.join_workers()
+            self.close_writer()
+            self.close_cache()
+            if self.manifest is not None:
+                # Keep track of written files even if the export failed
+                if success:
+                    self.process_deleted()
+                self.save_manifest()
+
+    def run(self):
+        """Runs the export to files (or other configured output)."""
+        for record in self.process():
+            pass
 
-    item_type = data['post_type']
-    if item_type not in ['post', 'page', 'draft']:
-        return
+    def feed(self, parser, chunk):
+        """Passes the input chunk to the XML parser."""
+        self.statplusplus('read_bytes', len(chunk))
+        started = timer()
+        parser.feed(chunk)
+        self.statplusplus('feed_time', timer() - started)
+
+    # Parallel parsing
+
+    def get_shards(self):
+        """Returns the dump beginning up to the channel start tag, which
+        defines the namespaces and the channel context for the workers,
+        and item ranges of the source file for parsing in worker processes
+        (see find_shards()). Returns None to parse the file sequentially."""
+        if not isinstance(self.source, (str_t, str)):
+            log.warn('Parallel parsing requires a dump file name.')
+            return None
 
-    fields = WHAT2SAVE['item']
-    pdata = {}
-    for field in fields:
-        pdata[FIELD_MAP.get(field, field)] = data.get(field, '')
+        conf = self.conf
+        with open(self.source, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return None
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # Several shards per worker to keep them all busy
+                shard_size = size // (conf['jobs'] * JOBS_BACKLOG)
+                shard_size = max(min(shard_size, SHARD_SIZE),
+                                 conf['chunk_size'])
+                shards = find_shards(data, shard_size)
+                match = shards and CHANNEL_START_RE.search(data, 0,
+                                                           shards[0][0])
+                context = match and data[:match.end()]
+            finally:
+                data.close()
+
+        if not context:
+            log.warn('Items not found in the dump, parsing sequentially.')
+            return None
+        return context, shards
+
+    def process_shards(self, parser, target, context, shards):
+        """Parses the items of the source file in worker processes (see
+        get_shards() for the arguments). The channel header and footer
+        are parsed by @parser, and the items are
+        passed to @target in the document order, so the output is the same
+        as with sequential parsing. Generates records collected by the
+        output writer (if any) after each shard."""
+        header_size = shards[0][0]
+        with open(self.source, 'rb') as f:
+            self.feed(parser, f.read(header_size))
+
+        pending = deque()
+
+        def add_items():
+            items = []
+            self.complete((pending.popleft(), items.extend))
+            # Items processing is nested in parsing, as in sequential
+            # mode (see get_report())
+            started = timer()
+            for data in items:
+                target.add_item(data)
+            self.statplusplus('feed_time', timer() - started)
+
+        for start, end in shards:
+            # Shards are parsed ahead while the items are processed
+            if len(pending) >= self.conf['jobs']:
+                add_items()
+                for record in self.take_records():
+                    yield record
+            args = ('parse_shard', (context, start, end))
+            pending.append(self.get_workers().apply_async(run_job, args))
+
+        while pending:
+            add_items()
+            for record in self.take_records():
+                yield record
+
+        with open(self.source, 'rb') as f:
+            f.seek(shards[-1][1])
+            self.feed(parser, f.read())
+
+    def parse_shard(self, context, start, end):
+        """Parses the items between @start and @end offsets of the source
+        file in a worker process, after the @context of the items (the
+        dump beginning up to the channel start tag). Returns the list of
+        parsed items."""
+        collector = ItemsCollector()
+        parser = XMLParser(target=CustomParser(collector))
+        parser.feed(context)
+        with open(self.source, 'rb') as f:
+            f.seek(start)
+            left = end - start
+            try:
+                while left > 0:
+                    chunk = f.read(min(left, self.conf['chunk_size']))
+                    if not chunk:
+                        break
+                    left -= len(chunk)
+                    self.feed(parser, chunk)
+            except ParseError as e:
+                raise self.shard_error(e, context, start)
+        return collector.items
+
+    def shard_error(self, e, context, start):
+        """Translates the position of a ParseError raised while parsing
+        the shard at @start offset back to the source file."""
+        line, column = e.position
+        line -= context.count(b'\n')
+        if line < 1:
+            return e
+        if line == 1:
+            column -= len(context) - context.rfind(b'\n') - 1
+        left = start
+        newlines = 0
+        last = b''
+        with open(self.source, 'rb') as f:
+            while left > 0:
+                chunk = f.read(min(left, self.conf['chunk_size']))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                newlines += chunk.count(b'\n')
+                last = chunk[chunk.rfind(b'\n') + 1:] if b'\n' in chunk \
+                    else last + chunk
+        if line == 1:
+            column += len(last)
+        line += newlines
+        msg = re.sub(r'line \d+, column \d+$',
+                     'line %d, column %d' % (line, column), str(e))
+        error = ParseError('%s (shard at byte %d)' % (msg, start))
+        error.code = e.code
+        error.position = (line, column)
+        return error
+
+    # Output paths
+
+    def get_path_fmt(self, item_type, data):
+        """Returns preconfigured export path format for specified
+        RSS item type and metadata."""
+
+        if data.get('status', None).lower() == 'draft':
+            return self.conf['draft_path']
+        is_post = item_type == 'post'
+        return self.conf['post_path'] if is_post else self.conf['page_path']
+
+    def get_root(self):
+        """Returns absolute path to the dump directory. The path is
+        defined once, so the output is not split at midnight."""
+        if self.root is None:
+            conf = self.conf
+            root = conf['dump_path']
+            root = root.format(date=time.strftime(conf['file_date_fmt']),
+                               source=os.path.basename(conf['source_file']),
+                               **date_parts(time.localtime()))
+            self.root = os.path.abspath(root)
+        return self.root
+
+    def get_path(self, item_type, file_name=None, data=None, unique=True):
+        """Generates full path for the generated file using configuration
+        and explicitly specified name or RSS item data. At least one argument
+        should be specified. @file_name has higher priority during output
+        path generation.
+
+        Arguments:
+            item_type -- 'post' or 'page'
+            file_name -- explicitly defined correct file name.
+            data -- preprocessed RSS item data dictionary.
+            unique -- add numeric suffix if the file already exists."""
+
+        if not file_name and type(data) is not dict:
+            raise Exception('File name or RSS item data dict should be defined')
+
+        if file_name:
+            relpath = file_name
+        else:
+            name = data.get('post_name', '').strip()
+            name = name or data.get('post_id', UNTITLED)
+            relpath = self.get_path_fmt(item_type, data)
+            field = FIELD_MAP.get('post_date', 'post_date')
+            relpath = relpath.format(name=name,
+                                     title=name,
+                                     **date_parts(data[field]))
+
+        result = os.path.join(self.get_root(), relpath)
+        return self.uniquify(result) if unique else result
+
+    def uniquify(self, file_name):
+        """Inserts numeric suffix at the end of file name to make
+        it's name unique in the directory. Names allocated during current
+        run are reserved even if the files are not written yet."""
+
+        dir_path, name = os.path.split(file_name)
+        names = self.get_dir_index(dir_path)
+        # Allocated names set only grows, so the smallest free suffix
+        # for the same file name never decreases
+        suffix = self.next_suffix.get(file_name, 0)
+        result = insert_suffix(name, suffix)
+        while result in names:
+            suffix += 1
+            result = insert_suffix(name, suffix)
+        names.add(result)
+        self.next_suffix[file_name] = suffix + 1
+        return os.path.join(dir_path, result)
+
+    def get_dir_index(self, dir_path):
+        """Returns the set of names existing or allocated in the directory.
+        Each directory is scanned once per run."""
+        names = self.dir_index.get(dir_path, None)
+        if names is None:
+            try:
+                names = set(os.listdir(dir_path))
+            except OSError:
+                names = set()
+            self.dir_index[dir_path] = names
+        return names
+
+    def reserve_path(self, file_name):
+        """Marks file name as allocated."""
+        dir_path, name = os.path.split(file_name)
+        self.get_dir_index(dir_path).add(name)
+
+    def release_path(self, file_name):
+        """Marks file name as free after the file removal."""
+        dir_path, name = os.path.split(file_name)
+        self.get_dir_index(dir_path).discard(name)
+        # Freed name could be a suffixed variant of any other name
+        for key in [key for key in self.next_suffix
+                    if os.path.dirname(key) == dir_path]:
+            del self.next_suffix[key]
+
+    # Markdown processing and generation
+
+    def convert_html(self, html):
+        h2t = get_converter(unicode_snob=True,
+                            inline_links=not self.conf['ref_links'],
+                            body_width=0)
+        return h2t.handle(html).strip()
+
+    @timed('html2md')
+    def html2md(self, html):
+        self.statplusplus('html2md_bytes', len(html.encode('utf-8')))
+        if html2text.is_markup_free(html):
+            # Plain text does not need the HTML parser
+            self.statplusplus('plain_text')
+            return html2text.text2md(html).strip()
+        return self.cached(self.convert_html, html, self.conf['ref_links'])
+
+    @timed('md2html')
+    def md2html(self, text):
+        self.statplusplus('md2html_bytes', len(text.encode('utf-8')))
+        return self.cached(convert_md, text)
+
+    def get_cache(self):
+        """Returns conversion cache for the current process or None if
+        caching is disabled. Each worker process opens its own connection."""
+        conf = self.conf
+        if not conf['cache_file']:
+            return None
+        if self.cache is None or self.cache[0] != os.getpid():
+            self.cache = (os.getpid(),
+                          ConversionCache(conf['cache_file'],
+                                          conf['cache_size']))
+        return self.cache[1]
+
+    def close_cache(self):
+        """Closes conversion cache applying the size limit."""
+        storage = self.get_cache()
+        if storage is not None:
+            storage.close()
+        self.cache = None
+
+    def cached(self, func, text, *options):
+        """Returns func(text) result from the conversion cache if possible.
+        Cache key is based on the function name, options and the text."""
+        storage = self.get_cache()
+        if storage is None or not text:
+            return func(text)
+
+        key = make_key(get_version(), func.__name__, options, text)
+        result = storage.get(key)
+        if result is None:
+            self.statplusplus('cache_miss')
+            result = func(text)
+            storage.put(key, result)
+        else:
+            self.statplusplus('cache_hit')
+        return result
+
+    def generate_comments(self, comments):
+        """Generates MD-formatted comments list from parsed data."""
+
+        result = []
+        cmfmt = str_t("**[{author}](#{id} \"{timestamp}\"):** {content}\n\n")
+        for comment in comments:
+            try:
+                approved = comment['comment_approved'] == '1'
+                pingback = comment.get('comment_type', '').lower() == 'pingback'
+                if approved and not pingback:
+                    content = self.html2md(comment['comment_content'])
+                    result.append(cmfmt.format(id=comment['comment_id'],
+                                               timestamp=comment['comment_date'],
+                                               author=comment['comment_author'],
+                                               content=content))
+            except:
+                # Ignore malformed data
+                pass
+
+        if not result:
+            return str_t('')
+        return str_t("## Comments\n\n") + str_t('').join(result)
+
+    @timed('fix_urls')
+    def fix_urls(self, text):
+        """Removes base_url prefix from MD links and image sources."""
+        if self.md_url_re is None:
+            base_url = re.escape(self.conf['base_url'])
+            self.md_url_re = re.compile(r'\]\(%s(.*)\)' % base_url)
+        return self.md_url_re.sub(r'](\1)', text)
+
+    # Statistics
+
+    def statplusplus(self, field, value=1):
+        if field in self.stats:
+            self.stats[field] += value
+        else:
+            raise ValueError("Illegal name for stats field: " + str(field))
+
+    def take_stats(self):
+        """Returns statistics and the slowest items collected since
+        the previous call."""
+        result = self.stats, self.slowest
+        self.stats = make_stats()
+        self.slowest = []
+        return result
+
+    def add_item_time(self, seconds, post_id, file_name):
+        """Keeps track of the slowest items."""
+        entry = (seconds, post_id, file_name)
+        if len(self.slowest) < self.conf['slowest']:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def get_report(self, elapsed=None):
+        """Returns processing statistics dictionary. Stage times are
+        the sums over all processes and nested: rendering includes
+        conversions, items processing includes rendering and writing
+        with a single process."""
+        stats = self.stats
+        stages = OrderedDict()
+        stages['parse'] = {
+            'time': stats['feed_time'] - stats['items_time'],
+            'bytes': stats['read_bytes'],
+        }
+        for stage in STAGES[1:]:
+            stages[stage] = {'time': stats[stage + '_time']}
+            if stage + '_bytes' in stats:
+                stages[stage]['bytes'] = stats[stage + '_bytes']
+
+        report = OrderedDict()
+        report['elapsed'] = elapsed
+        report['totals'] = OrderedDict(
+            (field, stats[field]) for field in sorted(stats)
+            if not field.endswith('_time') and field not in COUNTERS)
+        report['stages'] = stages
+        report['slowest'] = [
+            OrderedDict([('post_id', post_id),
+                         ('time', seconds),
+                         ('file', file_name)])
+            for seconds, post_id, file_name in sorted(self.slowest,
+                                                      reverse=True)]
+        return report
+
+    def save_report(self, file_name, elapsed=None):
+        """Saves processing statistics to JSON file."""
+        try:
+            with codecs.open(file_name, 'w', 'utf-8') as f:
+                json.dump(self.get_report(elapsed), f, indent=2)
+        except Exception as e:
+            log.error(getxm("Error saving statistics to '%s'" % file_name, e))
+
+    # Incremental export
+
+    def load_manifest(self):
+        """Loads items manifest from the previous export."""
+        file_name = os.path.join(self.get_root(), MANIFEST_FILE)
+        self.manifest = {'items': {}}
+        if not os.path.exists(file_name):
+            return
+        try:
+            with codecs.open(file_name, 'r', 'utf-8') as f:
+                self.manifest = json.load(f)
+        except Exception as e:
+            log.warn(getxm('Error reading manifest; exporting all items', e))
+
+    def save_manifest(self):
+        file_name = os.path.join(self.get_root(), MANIFEST_FILE)
+        temp_name = file_name + '.tmp'
+        try:
+            with codecs.open(temp_name, 'w', 'utf-8') as f:
+                json.dump(self.manifest, f, indent=1, sort_keys=True)
+            getattr(os, 'replace', os.rename)(temp_name, file_name)
+        except Exception as e:
+            log.error(getxm("Error saving manifest to '%s'" % file_name, e))
+
+    def item_hash(self, data):
+        """Returns a hash of RSS item data and the configuration values
+        affecting the generated file."""
+        fields = [(field, data.get(field, '')) for field in WHAT2SAVE['item']
+                  if field != 'comments']
+        comments = [sorted(comment.items()) for comment in data['comments']]
+        options = [self.conf[option] for option in OUTPUT_OPTIONS]
+        return make_key(get_version(), options, fields, comments)
+
+    def manifest_updater(self, post_id, digest, base_path, dump_path):
+        """Returns a callback updating manifest entry after the item
+        is dumped. Failed items are recorded without hash to be rewritten
+        in place next time."""
+        root = self.get_root()
+        entry = {
+            'hash': digest,
+            'base': os.path.relpath(base_path, root),
+            'path': os.path.relpath(dump_path, root),
+        }
+
+        def update(success):
+            if not success:
+                entry['hash'] = None
+            entry['modified'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            self.manifest['items'][post_id] = entry
+
+        return update
+
+    def process_deleted(self):
+        """Reports (or removes with --prune) previously exported items which
+        are missing in the current dump."""
+        root = self.get_root()
+        items = self.manifest['items']
+        for post_id in sorted(set(items) - self.seen_items):
+            file_name = os.path.join(root, items[post_id]['path'])
+            if self.conf['prune']:
+                log.info("Removing deleted item %s: '%s'" % (post_id, file_name))
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+                del items[post_id]
+            else:
+                log.info("Item %s was deleted: '%s'" % (post_id, file_name))
+            self.statplusplus('deleted')
+
+    # Parser data handlers
+
+    @timed('items')
+    def dump_channel(self, meta, items):
+        """Dumps RSS channel metadata and items index."""
+        unique = self.manifest is None
+        file_name = self.get_path('page', 'index.md', unique=unique)
+        log.info("Dumping index to '%s'" % file_name)
+        fields = WHAT2SAVE['channel']
+        meta = {field: meta.get(field, None) for field in fields}
+
+        # Append export_date
+        pub_date = meta.get('pubDate', None)
+        format = self.conf['parse_date_fmt']
+        meta['export_date'] = parse_date(pub_date, format, time.gmtime())
+
+        # Append table of contents
+        meta['content'] = generate_toc(meta, items)
+
+        # Channel follows all the items in shared output
+        self.drain()
+        self.dump(file_name, meta, fields)
+
+    @timed('items')
+    def dump_item(self, data):
+        """Dumps RSS channel item."""
+        if not 'post_type' in data:
+            log.error('Malformed RSS item: item type is not specified.')
+            return
 
-    # Post date
-    format = conf['date_fmt']
-    field = FIELD_MAP.get('post_date', 'post_date')
-    value = pdata.get(field, None)
-    pdata[field] = value and parse_date(value, format, None)
+        item_type = data['post_type']
+        if item_type not in EXPORT_TYPES:
+            return
 
-    # Post date GMT
-    field = FIELD_MAP.get('post_date_gmt', 'post_date_gmt')
-    value = pdata.get(field, None)
-    pdata[field] = value and parse_date(value, format, None)
+        fields = WHAT2SAVE['item']
+        pdata = {}
+        for field in fields:
+            pdata[FIELD_MAP.get(field, field)] = data.get(field, '')
 
-    dump_path = get_path(item_type, data=pdata)
-    log.info("Dumping %s to '%s'" % (item_type, dump_path))
+        # Post date
+        format = self.conf['date_fmt']
+        field = FIELD_MAP.get('post_date', 'post_date')
+        value = pdata.get(field, None)
+        pdata[field] = value and parse_date(value, format, None)
 
-    fields = [FIELD_MAP.get(field, field) for field in fields]
-    dump(dump_path, pdata, fields)
+        # Post date GMT
+        field = FIELD_MAP.get('post_date_gmt', 'post_date_gmt')
+        value = pdata.get(field, None)
+        pdata[field] = value and parse_date(value, format, None)
 
-    statplusplus(item_type)
-    if 'comments' in data:
-        statplusplus('comment', len(data['comments']))
+        callback = None
+        if self.manifest is None:
+            dump_path = self.get_path(item_type, data=pdata)
+        else:
+            root = self.get_root()
+            post_id = data.get('post_id', '')
+            self.seen_items.add(post_id)
+            digest = self.item_hash(data)
+            base_path = self.get_path(item_type, data=pdata, unique=False)
+            entry = self.manifest['items'].get(post_id, None)
+            dump_path = entry and os.path.join(root, entry['path'])
+            if entry and entry['base'] != os.path.relpath(base_path, root):
+                # File name pattern result changed, e.g. for published draft
+                if os.path.exists(dump_path):
+                    os.remove(dump_path)
+                    self.release_path(dump_path)
+                dump_path = None
+
+            if dump_path is None:
+                dump_path = self.uniquify(base_path)
+            elif entry['hash'] == digest and os.path.exists(dump_path):
+                log.debug("Skipping unchanged %s '%s'" % (item_type, dump_path))
+                self.reserve_path(dump_path)
+                dump_path = None
+                self.statplusplus('unchanged')
+            else:
+                # Rewriting changed item in place
+                self.reserve_path(dump_path)
+
+            if dump_path:
+                callback = self.manifest_updater(post_id, digest,
+                                                 base_path, dump_path)
+
+        if dump_path:
+            log.info("Dumping %s to '%s'" % (item_type, dump_path))
+            fields = [FIELD_MAP.get(field, field) for field in fields]
+            if self.conf['jobs'] > 1 and self.shared_output():
+                def written(text, dump_path=dump_path, callback=callback):
+                    result = self.write(dump_path, text)
+                    if callback:
+                        callback(result)
+
+                self.submit('render_safe', (dump_path, pdata, fields), written)
+            elif self.conf['jobs'] > 1:
+                self.submit('dump', (dump_path, pdata, fields), callback)
+            else:
+                result = self.dump(dump_path, pdata, fields)
+                if callback:
+                    callback(result)
+
+        self.statplusplus(item_type)
+        if 'comments' in data:
+            count = data.get('comment_count', len(data['comments']))
+            self.statplusplus('comment', count)
+
+    def store_base_url(self, channel):
+        """Stores base URL in configuration if it's not defined explicitly."""
+        if self.conf['fix_urls'] and not self.conf['base_url']:
+            self.conf['base_url'] = channel.get('base_site_url', '')
+
+    # Output
+
+    def dump(self, file_name, data, order):
+        """Dumps a dictionary to YAML-like text file."""
+        return self.write(file_name, self.render_safe(file_name, data, order))
+
+    @timed('write')
+    def write(self, file_name, text):
+        """Writes rendered document using the output writer. Returns False
+        if the document is missing or in case of error."""
+        if text is None:
+            return False
+        try:
+            self.get_writer().write(file_name, text)
+            if isinstance(text, str_t):
+                self.statplusplus('write_bytes', len(text.encode('utf-8')))
+            return True
+
+        except Exception as e:
+            report_error(file_name, e)
+            return False
+
+    def render_safe(self, file_name, data, order):
+        """Returns rendered document or None in case of error."""
+        started = timer()
+        try:
+            return self.render(data, order)
 
+        except Exception as e:
+            report_error(file_name, e)
+            return None
 
-def dump(file_name, data, order):
-    """Dumps a dictionary to YAML-like text file."""
-    try:
-        dir_path = os.path.dirname(os.path.abspath(file_name))
-        if dir_path and not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-
-        with codecs.open(file_name, 'w', 'utf-8') as f:
-            extras = {}
-            for field in filter(lambda x: x in data, [item for item in order]):
-                if field in ['content', 'comments', 'excerpt']:
-                    # Fields for non-standard processing
-                    extras[field] = data[field]
+        finally:
+            elapsed = timer() - started
+            self.statplusplus('render_time', elapsed)
+            if 'post_id' in data:
+                self.add_item_time(elapsed, data['post_id'], file_name)
+
+    def split_fields(self, data, order):
+        """Returns the list of formatted (field, value) pairs for the document
+        header and the dictionary of fields for non-standard processing."""
+        header = []
+        extras = {}
+        for field in filter(lambda x: x in data, [item for item in order]):
+            if field in ['content', 'comments', 'excerpt']:
+                # Fields for non-standard processing
+                extras[field] = data[field]
+            else:
+                if type(data[field]) == time.struct_time:
+                    date_fmt = self.conf['page_date_fmt']
+                    value = time.strftime(date_fmt, data[field])
                 else:
-                    if type(data[field]) == time.struct_time:
-                        value = time.strftime(conf['page_date_fmt'], data[field])
-                    else:
-                        value = data[field] or ''
-                    f.write(str_t("%s: %s\n") % (str_t(field), str_t(value)))
-
-            if extras:
-                excerpt = extras.get('excerpt', '')
-                excerpt = excerpt and '<!--%s-->' % excerpt
-
-                content = extras.get('content', '')
-                if conf['md_input']:
-                    # Using new MD instance works 3x faster than
-                    # reusing existing one for some reason
-                    md = markdown.Markdown(extensions=[])
-                    content = md.convert(content)
-
-                if conf['fix_urls']:
-                    content = fix_urls(html2md(content))
-
-                if 'title' in data:
-                    content = str_t("# %s\n\n%s") % (data['title'], content)
-
-                comments = generate_comments(extras.get('comments', []))
-                extras = filter(None, [excerpt, content, comments])
-                f.write('\n' + '\n\n'.join(extras))
-
-    except Exception as e:
-        log.error("Error saving data to '%s'" % (file_name))
-        log.debug(e)
-
-
-def store_base_url(channel):
-    """Stores base URL in configuration if it's not defined explicitly."""
-    if conf['fix_urls'] and not conf['base_url']:
-        conf['base_url'] = channel.get('base_site_url', '')
+                    value = data[field] or ''
+                header.append((field, value))
+        return header, extras
+
+    def convert_extras(self, extras):
+        """Returns excerpt, Markdown content and comments."""
+        excerpt = extras.get('excerpt', '')
+
+        content = extras.get('content', '')
+        passthrough = self.conf['md_passthrough'] and \
+            not HTML_TAG_RE.search(content)
+        if passthrough:
+            # Markdown input does not need a round trip through HTML
+            self.statplusplus('md_passthrough')
+            content = content.strip()
+        elif self.conf['md_input']:
+            content = self.md2html(content)
+
+        if self.conf['fix_urls']:
+            if not passthrough:
+                content = self.html2md(content)
+            content = self.fix_urls(content)
+
+        comments = self.generate_comments(extras.get('comments', []))
+        return excerpt, content, comments
+
+    def render(self, data, order):
+        """Generates YAML-like document text from a dictionary."""
+        if self.conf['records']:
+            return self.make_record(data, order)
+        if self.conf['ndjson']:
+            return self.render_json(data, order)
+
+        header, extras = self.split_fields(data, order)
+        result = [str_t("%s: %s\n") % (str_t(field), str_t(value))
+                  for field, value in header]
+
+        if extras:
+            excerpt, content, comments = self.convert_extras(extras)
+            excerpt = excerpt and '<!--%s-->' % excerpt
+
+            if 'title' in data:
+                content = str_t("# %s\n\n%s") % (data['title'], content)
+
+            extras = filter(None, [excerpt, content, comments])
+            result.append('\n' + '\n\n'.join(extras))
+
+        return str_t('').join(result)
+
+    def make_record(self, data, order):
+        """Generates output record from a dictionary. Content and comments
+        are converted to Markdown."""
+        header, extras = self.split_fields(data, order)
+        record = OrderedDict(header)
+        if extras:
+            values = zip(['excerpt', 'content', 'comments'],
+                         self.convert_extras(extras))
+            record.update((field, value) for field, value in values
+                          if field in extras)
+        return record
+
+    def render_json(self, data, order):
+        """Generates JSON record line from a dictionary."""
+        record = self.make_record(data, order)
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+    def shared_output(self):
+        """Returns True if the output could only be written by the parser
+        process, preserving the documents order."""
+        conf = self.conf
+        return conf['archive'] or conf['records'] or bool(conf['ndjson'])
+
+    def get_writer(self):
+        """Returns output writer for the current process."""
+        conf = self.conf
+        if self.writer is None or self.writer[0] != os.getpid():
+            if conf['records']:
+                result = ListWriter()
+            elif conf['ndjson']:
+                result = StreamWriter(conf['ndjson'])
+            elif conf['archive']:
+                result = make_archive_writer(self.get_root())
+            else:
+                result = FileWriter()
+            if conf['write_thread'] and conf['jobs'] == 1 and \
+                    not conf['records']:
+                result = ThreadedWriter(result, report_error)
+            self.writer = (os.getpid(), result)
+        return self.writer[1]
+
+    def take_records(self):
+        """Returns records collected since the previous call."""
+        if not self.conf['records'] or self.writer is None:
+            return []
+        return self.get_writer().take()
+
+    def close_writer(self):
+        """Completes pending writes."""
+        if self.writer is not None and self.writer[0] == os.getpid():
+            self.writer[1].close()
+        self.writer = None
+
+    # Worker processes
+
+    def complete(self, job):
+        """Waits for the task result, merges worker statistics and passes
+        the result to the callback."""
+        pending_result, callback = job
+        result, (delta, slowest) = pending_result.get()
+        for field, value in delta.items():
+            if value:
+                self.statplusplus(field, value)
+        for entry in slowest:
+            self.add_item_time(*entry)
+        if callback:
+            callback(result)
+
+    def submit(self, method, args, callback=None):
+        """Passes a task to the worker pool. Output paths are allocated
+        by the parser process, so the result does not depend on the order
+        of task completion. The number of pending tasks is limited to keep
+        memory usage bounded. @callback receives the task result in the
+        parser process."""
+        conf = self.conf
+        workers = self.get_workers()
+        while len(self.pending) >= conf['jobs'] * JOBS_BACKLOG:
+            self.complete(self.pending.popleft())
+        job = workers.apply_async(run_job, (method, args))
+        self.pending.append((job, callback))
+
+    def get_workers(self):
+        """Returns the worker pool. It is started lazily to pass
+        channel-dependent configuration."""
+        if self.workers is None:
+            conf = self.conf
+            self.workers = multiprocessing.Pool(conf['jobs'], init_worker,
+                                                (conf,))
+        return self.workers
+
+    def drain(self):
+        """Waits for all pending tasks."""
+        while self.pending:
+            self.complete(self.pending.popleft())
+
+    def join_workers(self):
+        """Waits for all pending tasks and stops the worker pool."""
+        self.drain()
+        if self.workers is not None:
+            self.workers.close()
+            self.workers.join()
+            self.workers = None
+
+
+def report_error(file_name, exception):
+    log.error("Error saving data to '%s'" % (file_name))
+    log.debug(exception)
+
+
+# Worker processes
+
+def init_worker(conf):
+    """Worker process initializer."""
+    global worker
+    worker = Exporter(conf)
+    # Buffered conversion cache changes are written at the process exit
+    Finalize(worker, close_worker, exitpriority=10)
+
+
+def close_worker():
+    """Closes conversion cache of the worker process if it was used."""
+    if worker.cache is not None:
+        worker.close_cache()
+
+
+def run_job(method, args):
+    """Runs exporter method in a worker process and returns its result
+    along with the statistics and the slowest items collected by the worker
+    since the previous task."""
+    result = getattr(worker, method)(*args)
+    return result, worker.take_stats()
 
 
 # The Parser
 
 class CustomParser:
-    def __init__(self):
+    """Collects RSS channel, items and comments data. Only WHAT2SAVE fields
+    are kept. Items of other than EXPORT_TYPES and comments which will not
+    be exported are dropped as soon as their type or status is known."""
+
+    fields = dict((section, set(fields))
+                  for section, fields in WHAT2SAVE.items())
+
+    def __init__(self, exporter):
+        self.exporter = exporter
         self.section_stack = []
+        self.section = None
         self.channel = {}
         self.items = []
         self.item = None
         self.cmnt = None
         self.subj = None
+        self.chunks = []
+        self.skip_item = False
+        self.skip_cmnt = False
+        self.values = {}  # Shared instances of SHARED_FIELDS values
+
+        # Tag handlers, other tags are the section fields
+        self.start_handlers = {
+            'channel': self.start_channel,
+            'item': self.start_item,
+            'comment': self.start_comment,
+        }
+        self.end_handlers = {
+            ('channel', 'channel'): self.end_channel,
+            ('channel', 'base_site_url'): self.end_base_site_url,
+            ('item', 'item'): self.end_item,
+            ('item', 'post_type'): self.check_item,
+            ('comment', 'comment'): self.end_comment,
+            ('comment', 'comment_approved'): self.check_comment,
+            ('comment', 'comment_type'): self.check_comment,
+        }
 
     def start(self, tag, attrib):
         tag = tag_name(tag)
-        if tag == 'channel':
-            self.start_section('channel')
+        handler = self.start_handlers.get(tag, None)
+        if handler:
+            handler()
+        else:
+            self.start_field(tag)
 
-        elif tag == 'item':
-            self.item = {'comments': []}
-            self.start_section('item')
+    def end(self, tag):
+        tag = tag_name(tag)
+        self.store_subj()
+        handler = self.end_handlers.get((self.section, tag), None)
+        if handler:
+            handler()
+        self.subj = None
 
-        elif self.item and tag == 'comment':
-            self.cmnt = {}
-            self.start_section('comment')
+    def data(self, data):
+        # Expat may split element text into several chunks, especially
+        # when the input is fed incrementally. They are joined at the end
+        # of the element to avoid copying multi-megabyte contents.
+        if self.subj:
+            self.chunks.append(data)
 
-        elif self.cur_section():
+    def start_field(self, tag):
+        section = self.section
+        if section and not self.skipped() and tag in self.fields[section]:
             self.subj = tag
-
+            self.chunks = []
         else:
             self.subj = None
 
-    def end(self, tag):
-        tag = tag_name(tag)
-        if tag == 'comment' and self.cur_section() == 'comment':
-            self.end_section()
-            self.item['comments'].append(self.cmnt)
-            self.cmnt = None
+    def start_channel(self):
+        self.start_section('channel')
 
-        elif tag == 'item' and self.cur_section() == 'item':
-            self.end_section()
-            dump_item(self.item)
-            self.store_item_info()
-            self.item = None
+    def start_item(self):
+        self.item = {'comments': [], 'comment_count': 0}
+        self.skip_item = False
+        self.start_section('item')
 
-        elif tag == 'channel':
-            self.end_section()
-            dump_channel(self.channel, self.items)
+    def start_comment(self):
+        if not self.item:
+            self.start_field('comment')
+            return
+        self.cmnt = {}
+        self.skip_cmnt = self.skip_item
+        self.start_section('comment')
 
-        elif self.cur_section():
-            self.subj = None
+    def end_channel(self):
+        self.end_section()
+        self.exporter.dump_channel(self.channel, self.items)
 
-    def data(self, data):
-        if self.subj:
-            if self.cur_section() == 'comment':
-                self.cmnt[self.subj] = data
+    def end_base_site_url(self):
+        self.exporter.store_base_url(self.channel)
 
-            elif self.cur_section() == 'item':
-                self.item[self.subj] = data
+    def end_item(self):
+        self.end_section()
+        if not self.skip_item:
+            self.add_item(self.item)
+        self.item = None
 
-            elif self.cur_section() == 'channel':
-                self.channel[self.subj] = data
-                if self.subj == 'base_site_url':
-                    store_base_url(self.channel)
-            self.subj = None
+    def add_item(self, item):
+        """Passes the item to the exporter and adds it to the index
+        (items parsed by the worker processes are added this way)."""
+        self.exporter.dump_item(item)
+        self.store_item_info(item)
+
+    def end_comment(self):
+        self.end_section()
+        if not self.skip_cmnt:
+            self.item['comments'].append(self.cmnt)
+        self.item['comment_count'] += 1
+        self.cmnt = None
+
+    def store_subj(self):
+        """Saves collected text of the current element to the section
+        record."""
+        if not self.subj or not self.chunks:
+            return
+        if self.section == 'comment':
+            record = self.cmnt
+        elif self.section == 'item':
+            record = self.item
+        elif self.section == 'channel':
+            record = self.channel
+        else:
+            return
+        value = ''.join(self.chunks)
+        if self.subj in SHARED_FIELDS:
+            value = self.values.setdefault(value, value)
+        record[self.subj] = value
+        self.chunks = []
+
+    def skipped(self):
+        """Returns True if current item or comment data is not needed."""
+        if self.section == 'comment':
+            return self.skip_cmnt
+        return self.section == 'item' and self.skip_item
+
+    def check_item(self):
+        """Drops the data of items which will not be exported."""
+        post_type = self.item.get('post_type', '')
+        if post_type.lower() not in EXPORT_TYPES:
+            self.skip_item = True
+            self.item = {'comments': [], 'comment_count': 0}
+
+    def check_comment(self):
+        """Drops the data of comments which will not be exported
+        (see generate_comments())."""
+        approved = self.cmnt.get('comment_approved', None)
+        comment_type = self.cmnt.get('comment_type', '')
+        if (approved is not None and approved != '1') or \
+                comment_type.lower() == 'pingback':
+            self.skip_cmnt = True
+            self.cmnt = {}
 
     def start_section(self, what):
         self.section_stack.append(what)
+        self.section = what
 
     def end_section(self):
         if len(self.section_stack):
             self.section_stack.pop()
+        self.section = self.section_stack[-1] if self.section_stack else None
 
-    def cur_section(self):
-        try:
-            return self.section_stack[-1]
-        except:
-            return None
-
-    def store_item_info(self):
-        post_type = self.item.get('post_type', '').lower()
+    def store_item_info(self, item):
+        post_type = item.get('post_type', '').lower()
         if not post_type in ['post', 'page']:
             return
+        self.items.append(IndexEntry(item))
 
-        fields = [
-            'title',
-            'link',
-            'post_id',
-            'post_date',
-            'post_type',
-        ]
 
-        self.items.append({})
-        for field in fields:
-            self.items[-1][field] = self.item.get(field, None)
+class ItemsCollector(object):
+    """CustomParser target collecting the items of a dump shard in
+    a worker process."""
+
+    def __init__(self):
+        self.items = []
+
+    def dump_item(self, data):
+        self.items.append(data)
+
+    def dump_channel(self, meta, items):
+        pass
+
+    def store_base_url(self, channel):
+        pass
+
+
+class IndexEntry(object):
+    """Table of contents entry for an exported post or page. The index
+    is kept until the end of the dump, so the entries avoid per-instance
+    dictionaries."""
+
+    __slots__ = ['title', 'link', 'post_id', 'post_date', 'post_type']
+
+    def __init__(self, data):
+        for field in self.__slots__:
+            setattr(self, field, data.get(field, None))
 
 
 def main():
-    init()
+    conf = init()
     log.info("Parsing '%s'..." % os.path.basename(conf['source_file']))
 
     stopwatch_set()
-    target = CustomParser()
-    parser = XMLParser(target=target)
-    if PY2:
-        text = open(conf['source_file']).read()
-    else:
-        text = codecs.open(conf['source_file'], encoding='utf-8').read()
-    parser.feed(text)
+    started = timer()
+    exporter = Exporter(conf)
+    exporter.run()
+    elapsed = timer() - started
 
     log.info('')
     totals = 'Total: posts: {post}; pages: {page}; comments: {comment}'
-    log.info(totals.format(**stats))
+    if conf['cache_file']:
+        totals += '; cache hits: {cache_hit}; misses: {cache_miss}'
+    if conf['incremental']:
+        totals += '; unchanged: {unchanged}; deleted: {deleted}'
+    log.info(totals.format(**exporter.stats))
     log.info('Elapsed time: %s s' % stopwatch_get())
 
+    report = exporter.get_report(elapsed)
+    for stage, values in report['stages'].items():
+        log.debug('%-8s %8.3f s' % (stage, values['time']))
+    for entry in report['slowest']:
+        log.debug('Slow item %s: %.3f s' % (entry['post_id'], entry['time']))
+    if conf['stats_json']:
+        exporter.save_report(conf['stats_json'], elapsed)
+
 
 if __name__ == '__main__':
     main()
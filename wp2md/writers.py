@@ -0,0 +1,195 @@
+# coding: utf-8
+"""Output writers for generated documents."""
+
+import errno
+import io
+import os.path
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+QUEUE_SIZE = 256  # Pending documents for the background writer
+
+# Archive file extensions and tarfile modes (None for zip)
+ARCHIVE_TYPES = [
+    ('.tar', 'w'),
+    ('.tar.gz', 'w:gz'),
+    ('.tgz', 'w:gz'),
+    ('.zip', None),
+]
+
+
+def get_archive_mode(file_name):
+    """Returns archive writer mode for the output path, or False if the
+    path is not an archive file name."""
+    name = file_name.lower()
+    for ext, mode in ARCHIVE_TYPES:
+        if name.endswith(ext):
+            return mode or 'zip'
+    return False
+
+
+def make_dirs(dir_path):
+    """Creates the directory with its parents. Worker processes could
+    create the same directory concurrently, so existing one is not
+    an error."""
+    try:
+        os.makedirs(dir_path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(dir_path):
+            raise
+
+
+def make_archive_writer(file_name):
+    """Creates archive writer for the file. Documents paths are stored
+    relative to the archive file path."""
+    dir_path = os.path.dirname(os.path.abspath(file_name))
+    if not os.path.isdir(dir_path):
+        make_dirs(dir_path)
+    mode = get_archive_mode(file_name)
+    if mode == 'zip':
+        return ZipWriter(file_name)
+    return TarWriter(file_name, mode)
+
+
+class FileWriter(object):
+    """Writes each document to a separate file with a single write call.
+    Existing directories are remembered to avoid repeated checks."""
+
+    def __init__(self):
+        self.dirs = set()
+
+    def write(self, file_name, text):
+        dir_path = os.path.dirname(file_name)
+        if dir_path not in self.dirs:
+            if dir_path and not os.path.isdir(dir_path):
+                make_dirs(dir_path)
+            self.dirs.add(dir_path)
+
+        with open(file_name, 'wb') as f:
+            f.write(text.encode('utf-8'))
+
+    def close(self):
+        pass
+
+
+class ArchiveWriter(object):
+    """Base class for writers storing documents to a single archive."""
+
+    def __init__(self, file_name):
+        self.root = os.path.abspath(file_name)
+
+    def get_arcname(self, file_name):
+        return os.path.relpath(file_name, self.root).replace(os.sep, '/')
+
+
+class TarWriter(ArchiveWriter):
+    def __init__(self, file_name, mode='w'):
+        ArchiveWriter.__init__(self, file_name)
+        self.archive = tarfile.open(file_name, mode)
+
+    def write(self, file_name, text):
+        data = text.encode('utf-8')
+        info = tarfile.TarInfo(self.get_arcname(file_name))
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o644
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+
+class ZipWriter(ArchiveWriter):
+    def __init__(self, file_name):
+        ArchiveWriter.__init__(self, file_name)
+        self.archive = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, file_name, text):
+        info = zipfile.ZipInfo(self.get_arcname(file_name),
+                               time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        self.archive.writestr(info, text.encode('utf-8'))
+
+    def close(self):
+        self.archive.close()
+
+
+class StreamWriter(object):
+    """Writes all documents one after another to a single file,
+    or to the standard output if the file name is '-'."""
+
+    def __init__(self, file_name):
+        if file_name == '-':
+            self.stream = getattr(sys.stdout, 'buffer', sys.stdout)
+        else:
+            self.stream = open(file_name, 'wb')
+
+    def write(self, file_name, text):
+        self.stream.write(text.encode('utf-8'))
+
+    def close(self):
+        if self.stream in [sys.stdout, getattr(sys.stdout, 'buffer', None)]:
+            self.stream.flush()
+        else:
+            self.stream.close()
+
+
+class ListWriter(object):
+    """Collects documents in memory until they are taken by the caller."""
+
+    def __init__(self):
+        self.documents = []
+
+    def write(self, file_name, document):
+        self.documents.append(document)
+
+    def take(self):
+        """Returns documents written since the previous call."""
+        result = self.documents
+        self.documents = []
+        return result
+
+    def close(self):
+        pass
+
+
+class ThreadedWriter(object):
+    """Passes documents to another writer in a background thread, so disk
+    I/O overlaps with parsing and conversion. Write errors are passed to
+    @on_error callback along with the file name."""
+
+    def __init__(self, writer, on_error):
+        self.writer = writer
+        self.on_error = on_error
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, file_name, text):
+        self.queue.put((file_name, text))
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            file_name, text = task
+            try:
+                self.writer.write(file_name, text)
+            except Exception as e:
+                self.on_error(file_name, e)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()